@@ -0,0 +1,221 @@
+"""
+Vectorized statistics of evaluation answers.
+
+Answers of completed sessions are loaded into a dense sessions x questions matrix
+of real answers (as stored, see ``Question.get_real_answer``), ``MISSING`` where
+a session didn't answer. For selection questions answer 1 is the right, "proposed" image.
+"""
+import io
+import warnings
+from itertools import chain
+from typing import NamedTuple, Optional
+
+import numpy as np
+from django.conf import settings
+
+from .models import Evaluation, Question, Session, Assignment
+
+MISSING = -1
+# Resamples computed at once, bounds memory of bootstrap to a few resamples x sessions
+BOOTSTRAP_CHUNK = 64
+
+
+class AnswerMatrix(NamedTuple):
+    # int16 sessions x questions, MISSING where not answered
+    answers: np.ndarray
+    # Ids of sessions by row
+    session_ids: np.ndarray
+    # Question orders by column
+    orders: np.ndarray
+
+    @property
+    def variants(self) -> int:
+        """
+        Number of distinct answer values, at least 2
+        """
+        return max(int(self.answers.max(initial=0)) + 1, 2)
+
+
+def find(sorted_keys: np.ndarray, keys: np.ndarray):
+    """
+    :return: (positions of ``keys`` in ``sorted_keys``, mask of keys found there)
+    """
+    positions = np.searchsorted(sorted_keys, keys)
+    found = np.zeros(len(keys), dtype=bool)
+    inside = positions < len(sorted_keys)
+    found[inside] = sorted_keys[positions[inside]] == keys[inside]
+    return positions, found
+
+
+def load_matrix(evaluation: Evaluation) -> AnswerMatrix:
+    """
+    Answers of completed sessions, both stored as rows and packed.
+    Queries aren't in one transaction, which would hold the database lock while reading,
+    so answers of sessions completed or questions added in between are left out.
+    """
+    orders = np.array(Question.objects
+                      .filter(evaluation=evaluation)
+                      .order_by('order')
+                      .values_list('order', flat=True), dtype=np.int64)
+    session_ids = np.array(Session.objects
+                           .filter(evaluation=evaluation, completed_at__isnull=False)
+                           .order_by('id')
+                           .values_list('id', flat=True), dtype=np.int64)
+    answers = np.full((len(session_ids), len(orders)), MISSING, dtype=np.int16)
+
+    rows = Assignment.objects \
+        .filter(evaluation=evaluation, session__completed_at__isnull=False) \
+        .values_list('session_id', 'question__order', 'answer') \
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    # Flat, so millions of answers don't become millions of tuples
+    session_id, order, answer = np.fromiter(chain.from_iterable(rows), dtype=np.int64) \
+        .reshape(-1, 3).T
+    rows, found_rows = find(session_ids, session_id)
+    columns, found_columns = find(orders, order)
+    found = found_rows & found_columns
+    answers[rows[found], columns[found]] = answer[found]
+
+    if len(orders):
+        for id, packed in Session.packed(evaluation):
+            (row,), (found,) = find(session_ids, np.array([id]))
+            if not found:
+                continue
+            packed = np.frombuffer(packed, dtype=np.int16)
+            known = orders < len(packed)
+            answers[row, known] = packed[orders[known]]
+
+    return AnswerMatrix(answers=answers, session_ids=session_ids, orders=orders)
+
+
+def answer_counts(matrix: AnswerMatrix) -> np.ndarray:
+    """
+    :return: questions x variants numbers of each answer
+    """
+    return np.stack([(matrix.answers == answer).sum(axis=0)
+                     for answer in range(matrix.variants)], axis=1)
+
+
+def shares(counts: np.ndarray) -> np.ndarray:
+    """
+    Shares of answers along the last axis of ``counts``, NaN where there are none
+    """
+    totals = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, counts / np.maximum(totals, 1), np.nan)
+
+
+def annotator_agreement(matrix: AnswerMatrix, counts: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    :return: for each session, the chance that another session's answer to the same
+        question matches its own, averaged over its answers; NaN if nothing to compare
+    """
+    if counts is None:
+        counts = answer_counts(matrix)
+    answered = matrix.answers != MISSING
+    # Answers of others which are the same as session's and all answers of others
+    same = np.take_along_axis(counts.T, np.where(answered, matrix.answers, 0), axis=0) - 1
+    others = counts.sum(axis=1) - 1
+    comparable = answered & (others > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        agreement = np.where(comparable, same / np.maximum(others, 1), 0).sum(axis=1) \
+                    / comparable.sum(axis=1)
+    return agreement
+
+
+class Bootstrap(NamedTuple):
+    # questions x variants bounds of answer shares
+    low: np.ndarray
+    high: np.ndarray
+    # variants bounds of answer shares over all questions
+    overall_low: np.ndarray
+    overall_high: np.ndarray
+
+
+def bootstrap(matrix: AnswerMatrix, resamples: int, confidence: float = 0.95,
+              seed: Optional[int] = None) -> Bootstrap:
+    """
+    Percentile intervals of answer shares, resampling sessions with replacement.
+    Each resample is a vector of session multiplicities, so answer counts of a batch of
+    resamples are a single matrix product with answer indicators.
+    """
+    sessions, questions = matrix.answers.shape
+    variants = matrix.variants
+    if not sessions or not resamples:
+        unknown, overall_unknown = np.full((questions, variants), np.nan), np.full(variants, np.nan)
+        return Bootstrap(low=unknown, high=unknown,
+                         overall_low=overall_unknown, overall_high=overall_unknown)
+
+    rng = np.random.default_rng(seed)
+    # sessions x (questions * variants)
+    indicators = np.concatenate([(matrix.answers == answer).astype(np.float32)
+                                 for answer in range(variants)], axis=1)
+
+    per_question = np.empty((resamples, questions, variants), dtype=np.float32)
+    overall = np.empty((resamples, variants), dtype=np.float32)
+    for start in range(0, resamples, BOOTSTRAP_CHUNK):
+        chunk = min(BOOTSTRAP_CHUNK, resamples - start)
+        picks = rng.integers(0, sessions, size=(chunk, sessions)) \
+            + np.arange(chunk)[:, None] * sessions
+        weights = np.bincount(picks.ravel(), minlength=chunk * sessions) \
+            .reshape(chunk, sessions) \
+            .astype(np.float32)
+        counts = (weights @ indicators).reshape(chunk, variants, questions).transpose(0, 2, 1)
+        per_question[start:start + chunk] = shares(counts)
+        overall[start:start + chunk] = shares(counts.sum(axis=1))
+
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # Questions without answers in a resample are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanpercentile(per_question, [tail, 100 - tail], axis=0)
+        overall_low, overall_high = np.nanpercentile(overall, [tail, 100 - tail], axis=0)
+    return Bootstrap(low=low, high=high, overall_low=overall_low, overall_high=overall_high)
+
+
+def analyze(evaluation: Evaluation, resamples: Optional[int] = None, seed: Optional[int] = None):
+    """
+    :return: (matrix, dict of statistics arrays)
+    """
+    if resamples is None:
+        resamples = settings.ANALYSIS_BOOTSTRAP_RESAMPLES
+    matrix = load_matrix(evaluation)
+    counts = answer_counts(matrix)
+    intervals = bootstrap(matrix, resamples, seed=seed)
+    return matrix, dict(
+        answer_counts=counts,
+        answer_shares=shares(counts),
+        answer_shares_low=intervals.low,
+        answer_shares_high=intervals.high,
+        overall_shares=shares(counts.sum(axis=0)),
+        overall_shares_low=intervals.overall_low,
+        overall_shares_high=intervals.overall_high,
+        agreement=annotator_agreement(matrix, counts),
+    )
+
+
+def export_npz(evaluation: Evaluation) -> bytes:
+    matrix, statistics = analyze(evaluation)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, answers=matrix.answers, session_ids=matrix.session_ids,
+                        orders=matrix.orders, missing=MISSING, **statistics)
+    return buffer.getvalue()
+
+
+def summary(evaluation: Evaluation) -> str:
+    """
+    One line description of answers for admin
+    """
+    matrix, statistics = analyze(evaluation)
+    if not matrix.answers.size:
+        return f'{evaluation}: no answers'
+    parts = [
+        f'answer {answer}: {share:.1%} ({low:.1%}-{high:.1%})'
+        for answer, (share, low, high) in enumerate(zip(statistics['overall_shares'],
+                                                        statistics['overall_shares_low'],
+                                                        statistics['overall_shares_high']))
+    ]
+    agreement = statistics['agreement']
+    mean_agreement = np.nanmean(agreement) if np.isfinite(agreement).any() else np.nan
+    return f'{evaluation}: {len(matrix.session_ids)} sessions, ' \
+           f'{int((matrix.answers != MISSING).sum())} answers; {", ".join(parts)}; ' \
+           f'mean agreement {mean_agreement:.1%}'
@@ -0,0 +1,67 @@
+"""
+Evaluation sources: ZIP archives and directory trees laid out the same way.
+Used by worker processes too, so must not touch Django models or settings.
+"""
+import os
+from typing import IO, List, NamedTuple, Union
+from zipfile import ZipFile
+
+
+class DirectoryMember(NamedTuple):
+    """
+    File of ``DirectoryArchive``, mirrors fields of ``ZipInfo`` ingestion reads
+    """
+    # Path relative to the directory, separated by '/' like archive member names
+    filename: str
+    file_size: int
+
+    def is_dir(self) -> bool:
+        return False
+
+
+class DirectoryArchive:
+    """
+    Directory read through the part of ``ZipFile`` interface ingestion uses,
+    so archive parsers and their structure checks work on unpacked archives as is
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def infolist(self) -> List[DirectoryMember]:
+        members = []
+        for directory, subdirectories, files in os.walk(self.path):
+            subdirectories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                members.append(DirectoryMember(
+                    filename=os.path.relpath(path, self.path).replace(os.sep, '/'),
+                    file_size=os.path.getsize(path)
+                ))
+        return members
+
+    def open(self, member: Union[str, DirectoryMember], mode='r') -> IO[bytes]:
+        name = member if isinstance(member, str) else member.filename
+        return open(os.path.join(self.path, *name.split('/')), 'rb')
+
+    def read(self, member: Union[str, DirectoryMember]) -> bytes:
+        with self.open(member) as file:
+            return file.read()
+
+
+def open_archive(source) -> Union[ZipFile, DirectoryArchive]:
+    """
+    :param source: path of directory or ZIP file, or ZIP file stream
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        return DirectoryArchive(source)
+    return ZipFile(source)
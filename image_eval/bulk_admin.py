@@ -0,0 +1,120 @@
+"""
+Admin pieces for tables too big for Django defaults, like sessions and answers.
+
+Changelists are paged by primary key instead of OFFSET, so every page costs the same,
+and count rows only up to ``ADMIN_COUNT_LIMIT``. Deletions remove dependent rows
+in chunks instead of collecting them all in memory first.
+"""
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+# Query parameter with primary key the page starts after
+AFTER_VAR = 'after'
+
+
+class CappedCountPaginator(Paginator):
+    @cached_property
+    def count(self) -> int:
+        """
+        Number of rows, but at most ``ADMIN_COUNT_LIMIT``
+        """
+        return self.object_list[:settings.ADMIN_COUNT_LIMIT].count()
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Shows rows ordered from the newest primary key, next pages are linked by
+    the last shown key rather than page number
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            self.after = int(request.GET[AFTER_VAR])
+        except (KeyError, ValueError):
+            self.after = None
+        self.keyset = True
+        self.count_limit = settings.ADMIN_COUNT_LIMIT
+        self.next_url = self.first_url = None
+        super().__init__(request, *args, **kwargs)
+        # Links changing filters start from the first page, like ones dropping PAGE_VAR
+        self.params.pop(AFTER_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_results(self, request):
+        queryset = self.queryset
+        if self.after is not None:
+            queryset = queryset.filter(pk__lt=self.after)
+        rows = list(queryset[:self.list_per_page + 1])
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = len(rows) > self.list_per_page or self.after is not None
+        if len(rows) > self.list_per_page:
+            self.next_url = self.get_query_string({AFTER_VAR: self.result_list[-1].pk})
+        if self.after is not None:
+            self.first_url = self.get_query_string(remove=[AFTER_VAR])
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    """
+    Admin paging with ``KeysetChangeList``, columns can't be sorted
+    """
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    sortable_by = []
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class CompletedListFilter(admin.SimpleListFilter):
+    title = 'completed'
+    parameter_name = 'completed'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset: QuerySet):
+        if self.value() == 'yes':
+            return queryset.filter(completed_at__isnull=False)
+        if self.value() == 'no':
+            return queryset.filter(completed_at__isnull=True)
+        return queryset
+
+
+def delete_in_chunks(queryset: QuerySet):
+    """
+    Deletes rows of ``queryset`` ``DELETE_CHUNK_SIZE`` at a time, so neither the rows
+    nor their ids are ever all in memory
+    """
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:settings.DELETE_CHUNK_SIZE])
+        if not ids:
+            return
+        queryset.model._base_manager.filter(pk__in=ids).delete()
+
+
+def summarize_deletion(objs, opts):
+    """
+    Deletion confirmation listing just the deleted objects, as ``get_deleted_objects``
+    of ``ModelAdmin`` would load every related row to list them
+    """
+    deleted_objects = [f'{opts.verbose_name.capitalize()}: {obj}' for obj in objs]
+    model_count = {opts.verbose_name_plural: len(deleted_objects)}
+    return deleted_objects, model_count, set(), []
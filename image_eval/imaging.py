@@ -0,0 +1,131 @@
+"""
+Image processing helpers which run in worker processes,
+so they must not touch Django models or settings
+"""
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+from zipfile import ZipFile
+
+from PIL import Image
+
+from .archives import open_archive
+
+Image.init()
+
+MODERN_FORMATS = [f for f in ['AVIF', 'WEBP'] if f in Image.SAVE]
+
+# Formats accepted in uploaded archives
+ACCEPTED_FORMATS = ['JPEG', 'PNG', 'WEBP', 'GIF', 'BMP', 'TIFF']
+
+MIME_TYPES = {
+    'AVIF': 'image/avif',
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp',
+    'TIFF': 'image/tiff',
+}
+
+EXTENSIONS = {
+    'AVIF': '.avif',
+    'WEBP': '.webp',
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'BMP': '.bmp',
+    'TIFF': '.tif',
+}
+
+SAVE_OPTIONS = {
+    # Default speed takes seconds per large image, which ingestion can't afford
+    'AVIF': dict(quality=60, speed=9),
+    'WEBP': dict(quality=80, method=4),
+    'JPEG': dict(quality=85, optimize=True, progressive=True),
+    'PNG': dict(optimize=True),
+}
+
+
+def render_variants(path: str, widths: Sequence[int]) -> List[Tuple[int, str, bytes]]:
+    """
+    Downscales image at ``path`` to every width from ``widths`` smaller than the image itself
+    (or to its own width if it isn't bigger than the largest one) and encodes each size
+    in all supported modern formats plus JPEG (PNG for PNG sources) as a fallback
+
+    :return: list of (width, format, encoded bytes)
+    """
+    # Closing image discards its data, so all work is done while it is open
+    with Image.open(path) as image:
+        fallback = 'PNG' if image.format == 'PNG' else 'JPEG'
+        image.load()
+
+        source_width, source_height = image.size
+        sizes = [w for w in sorted(widths) if w < source_width]
+        if source_width <= max(widths):
+            sizes.append(source_width)
+
+        variants = []
+        for width in sizes:
+            height = max(1, round(source_height * width / source_width))
+            resized = image if width == source_width \
+                else image.resize((width, height), Image.LANCZOS)
+            for format in MODERN_FORMATS + [fallback]:
+                converted = resized
+                if format == 'JPEG' and resized.mode != 'RGB':
+                    converted = resized.convert('RGB')
+                elif resized.mode not in ('RGB', 'RGBA', 'L'):
+                    converted = resized.convert('RGBA')
+                stream = BytesIO()
+                converted.save(stream, format, **SAVE_OPTIONS[format])
+                variants.append((width, format, stream.getvalue()))
+    return variants
+
+
+def inspect_image(stream) -> Tuple[str, int, int]:
+    """
+    Fully decodes image, so truncated or corrupt data is detected
+
+    :return: (format, width, height)
+    :raises ValueError: with the reason if image can't be used
+    """
+    try:
+        image = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        # Raised by open already for sizes far over the limit
+        raise ValueError(f'image too large: {e}') from e
+    except (OSError, SyntaxError) as e:
+        raise ValueError('not an image or unknown format') from e
+
+    with image:
+        if image.format not in ACCEPTED_FORMATS:
+            raise ValueError(f'unsupported format {image.format}, '
+                             f'expected one of {", ".join(ACCEPTED_FORMATS)}')
+        try:
+            image.load()
+        except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+            raise ValueError(f'corrupt image: {e}') from e
+        return image.format, image.width, image.height
+
+
+def inspect_members(archive: ZipFile, names: Sequence[str]) \
+        -> List[Tuple[str, Optional[Tuple[str, int, int]], Optional[str]]]:
+    """
+    :return: list of (member name, ``inspect_image`` result or None, error or None)
+    """
+    results = []
+    for name in names:
+        try:
+            # Archive members aren't seekable before Python 3.7
+            data = BytesIO(archive.read(name))
+            results.append((name, inspect_image(data), None))
+        except ValueError as e:
+            results.append((name, None, str(e)))
+    return results
+
+
+def inspect_archive(path: str, names: Sequence[str]):
+    """
+    ``inspect_members`` of the archive or directory at ``path``, for worker processes
+    """
+    with open_archive(path) as archive:
+        return inspect_members(archive, names)
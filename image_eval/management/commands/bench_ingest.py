@@ -0,0 +1,120 @@
+import json
+import os
+import resource
+import tempfile
+import time
+
+from django.core.files.base import File
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from image_eval.models import Evaluation, IngestionJob
+from image_eval.tests.synthetic import write_selection_archive, write_classification_archive
+from .bench_survey import QueryCounter, current_commit
+
+ARCHIVE_WRITERS = {
+    'SEL': write_selection_archive,
+    'CLS': write_classification_archive,
+}
+
+
+def parse_size(value: str):
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise CommandError(f'Size must look like 640x480, got {value}')
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # Linux reports kilobytes
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Measures ingestion of synthetic archives end to end, as a background job would ' \
+           'run it. Creates and removes its own evaluations in the configured database, ' \
+           'so point VAR_DIR to a scratch directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=ARCHIVE_WRITERS.keys(), nargs='+',
+                            default=list(ARCHIVE_WRITERS.keys()))
+        parser.add_argument('--counts', type=int, nargs='+', default=[50, 200],
+                            help='Questions per archive, several values show how ingestion scales')
+        parser.add_argument('--size', type=parse_size, default=(640, 480),
+                            help='Image resolution, WIDTHxHEIGHT')
+        parser.add_argument('--png-ratio', type=float, default=0.2,
+                            help='Share of PNG images, the rest are JPEG')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write JSON report to this file instead of stdout')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the ingested evaluations")
+
+    def handle(self, *args, type, counts, size, png_ratio, seed, output, keep, **options):
+        runs = []
+        # Peak RSS can only grow during the process, so go from smaller archives to larger
+        for count in sorted(counts):
+            for evaluation_type in type:
+                runs.append(self.run(evaluation_type, count, size, png_ratio, seed, keep))
+
+        report = dict(
+            commit=current_commit(),
+            config=dict(size=f'{size[0]}x{size[1]}', png_ratio=png_ratio, seed=seed),
+            runs=runs,
+        )
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+            for run in runs:
+                self.stdout.write(
+                    f"{run['type']} {run['questions']:6} q {run['images']:6} img "
+                    f"{run['seconds']:7.1f} s {run['images_per_s']:7.1f} img/s "
+                    f"{run['mb_per_s']:6.1f} MB/s {run['statements_per_image']:5.1f} stmt/img "
+                    f"peak {run['peak_rss_mb']:.0f} MB {run['status']}"
+                )
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def run(self, evaluation_type: str, count: int, size, png_ratio: float, seed: int,
+            keep: bool) -> dict:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.zip')
+            with open(path, 'wb') as stream:
+                ARCHIVE_WRITERS[evaluation_type](stream, count, size, png_ratio, seed)
+            archive_bytes = os.path.getsize(path)
+
+            evaluation = Evaluation(title=f'Ingestion benchmark {count}', type=evaluation_type,
+                                    created_at=timezone.now(), total_questions=0)
+            evaluation.save()
+            with open(path, 'rb') as stream:
+                job = IngestionJob(evaluation=evaluation, archive=File(stream, 'archive.zip'),
+                                   question_text='Benchmark')
+                job.save()
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            job.run()
+        seconds = time.perf_counter() - start
+
+        images = job.total_members
+        result = dict(
+            type=evaluation_type,
+            questions=count,
+            images=images,
+            archive_mb=archive_bytes / 2 ** 20,
+            status=job.status,
+            error=job.error,
+            seconds=seconds,
+            images_per_s=images / seconds,
+            mb_per_s=job.total_bytes / 2 ** 20 / seconds,
+            statements=counter.queries,
+            statements_per_image=counter.queries / max(images, 1),
+            peak_rss_mb=peak_rss_mb(),
+            peak_children_rss_mb=peak_rss_mb(resource.RUSAGE_CHILDREN),
+        )
+        if not keep:
+            evaluation.delete()
+        return result
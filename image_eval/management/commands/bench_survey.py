@@ -0,0 +1,201 @@
+import json
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import connection, OperationalError
+from django.http import HttpResponse
+from django.test import Client
+from django.urls import reverse
+
+from image_eval.tests.synthetic import make_selection_evaluation
+
+QUESTION_ID = re.compile(rb'name="question_id" value="(\d+)"')
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries of the current thread connection
+    """
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # endpoint -> [(seconds, queries, error)]
+        self.samples: Dict[str, List[tuple]] = defaultdict(list)
+
+    def request(self, endpoint: str, counter: QueryCounter,
+                send: Callable[[], HttpResponse]) -> Optional[HttpResponse]:
+        counter.queries = 0
+        response = None
+        error = None
+        start = time.perf_counter()
+        try:
+            response = send()
+            if response.streaming:
+                b''.join(response.streaming_content)
+            if response.status_code >= 400:
+                error = f'http {response.status_code}'
+        except OperationalError as e:
+            error = 'locked' if 'locked' in str(e) else 'database'
+        except Exception as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.samples[endpoint].append((elapsed, counter.queries, error))
+        return None if error else response
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds for seconds, _, _ in samples)
+            errors = [error for _, _, error in samples if error]
+            endpoints[endpoint] = dict(
+                requests=len(samples),
+                throughput_rps=len(samples) / duration,
+                p50_ms=percentile(latencies, 50) * 1000,
+                p95_ms=percentile(latencies, 95) * 1000,
+                p99_ms=percentile(latencies, 99) * 1000,
+                max_ms=latencies[-1] * 1000,
+                queries_per_request=sum(queries for _, queries, _ in samples) / len(samples),
+                errors=len(errors),
+                lock_error_rate=errors.count('locked') / len(samples),
+            )
+        return endpoints
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted ``values``
+    """
+    rank = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measures survey views under concurrent synthetic participants. ' \
+           'Creates and removes its own evaluation in the configured database, ' \
+           'so point VAR_DIR to a scratch directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--participants', type=int, default=20,
+                            help='Number of participants answering concurrently')
+        parser.add_argument('--answers', type=int, default=None,
+                            help='Answers given by each participant, all questions by default')
+        parser.add_argument('--export-interval', type=float, default=1.0,
+                            help='Seconds between results exports made during the run')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write JSON report to this file instead of stdout')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the synthetic evaluation and sessions")
+
+    def handle(self, *args, questions, participants, answers, export_interval, seed, output,
+               keep, **options):
+        evaluation = make_selection_evaluation(questions, title='Benchmark')
+        staff = get_user_model().objects.create_user(
+            f'bench-{random.getrandbits(32):08x}', is_staff=True
+        )
+        recorder = Recorder()
+        finished = threading.Event()
+
+        def participant(no: int):
+            rng = random.Random(seed * 100_003 + no)
+            client = Client(HTTP_HOST='localhost')
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                response = recorder.request('new_session', counter, lambda: client.post(
+                    reverse('new_session'),
+                    dict(evaluation_id=evaluation.id, name=f'participant {no}', comment='')
+                ))
+                if response is None:
+                    return
+                url = response['Location']
+                page = recorder.request('session_view', counter, lambda: client.get(url))
+                answered = failures = 0
+                while answered < (questions if answers is None else answers) and failures < 10:
+                    if page is None:
+                        # Failed, resume where the session stopped
+                        failures += 1
+                        page = recorder.request('session_view', counter, lambda: client.get(url))
+                        continue
+                    question_id = QUESTION_ID.search(page.content)
+                    if question_id is None:
+                        break
+                    page = recorder.request('session_view', counter, lambda: client.post(url, dict(
+                        question_id=question_id.group(1).decode(), answer=rng.randint(0, 1)
+                    )))
+                    answered += page is not None
+            connection.close()
+
+        def exporter():
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(staff)
+            counter = QueryCounter()
+            url = reverse('export_result', kwargs=dict(id=evaluation.id))
+            with connection.execute_wrapper(counter):
+                while not finished.is_set():
+                    recorder.request('export_results', counter, lambda: client.get(url))
+                    finished.wait(export_interval)
+            connection.close()
+
+        threads = [threading.Thread(target=participant, args=(no,)) for no in range(participants)]
+        export_thread = threading.Thread(target=exporter)
+
+        start = time.perf_counter()
+        export_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        finished.set()
+        export_thread.join()
+        duration = time.perf_counter() - start
+
+        report = dict(
+            commit=current_commit(),
+            config=dict(questions=questions, participants=participants, answers=answers,
+                        export_interval=export_interval, seed=seed),
+            duration_s=duration,
+            endpoints=recorder.report(duration),
+        )
+
+        if not keep:
+            evaluation.delete()
+            staff.delete()
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+            for endpoint, stats in report['endpoints'].items():
+                self.stdout.write(
+                    f"{endpoint:15} {stats['requests']:6} req {stats['throughput_rps']:8.1f} rps "
+                    f"p50 {stats['p50_ms']:7.1f} p95 {stats['p95_ms']:7.1f} "
+                    f"p99 {stats['p99_ms']:7.1f} ms {stats['queries_per_request']:5.1f} q/req "
+                    f"locked {stats['lock_error_rate']:.1%}"
+                )
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
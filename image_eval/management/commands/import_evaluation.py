@@ -0,0 +1,69 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from image_eval.models import Evaluation, IngestionJob
+
+
+class Command(BaseCommand):
+    help = 'Creates evaluation from a ZIP archive or a directory laid out the same way, ' \
+           'read in place on the server. Progress is committed in chunks, so running ' \
+           'the command again for the same path resumes an interrupted import.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='ZIP archive or directory')
+        parser.add_argument('--type', choices=Evaluation.TYPES.keys(), required=True)
+        parser.add_argument('--title', help='Evaluation title, name of the path by default')
+        parser.add_argument('--question', default='', help='Question text')
+        parser.add_argument('--shuffle', action='store_true',
+                            help='Show questions in per-session random order')
+        parser.add_argument('--allocate', action='store_true',
+                            help='Serve least answered questions first')
+        parser.add_argument('--questions-per-session', type=int)
+        parser.add_argument('--workers', type=int,
+                            help='Threads copying images, INGESTION_COPY_WORKERS by default')
+        parser.add_argument('--restart', action='store_true',
+                            help='Start a new import even if an unfinished one exists')
+        parser.add_argument('--force', action='store_true',
+                            help='Resume import which looks running, when its process was killed')
+
+    def handle(self, *args, path, type, title, question, shuffle, allocate,
+               questions_per_session, workers, restart, force, **options):
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+
+        job = None
+        if not restart:
+            job = IngestionJob.objects \
+                .filter(source_path=path, evaluation__type=type) \
+                .exclude(status='DONE') \
+                .order_by('-created_at') \
+                .first()
+        if job is None:
+            evaluation = Evaluation(title=title or os.path.basename(path.rstrip(os.sep)),
+                                    type=type, shuffle=shuffle, allocate=allocate,
+                                    questions_per_session=questions_per_session,
+                                    created_at=timezone.now(), total_questions=0)
+            evaluation.save()
+            job = IngestionJob(evaluation=evaluation, source_path=path, question_text=question)
+            self.stdout.write(f'Importing {path} into evaluation {evaluation.id}')
+        else:
+            if job.status == 'RUNNING' and not force:
+                state = 'has not reported progress for a while' if job.stale else 'is running'
+                raise CommandError(f'Job {job.id} importing {path} {state}, use --force '
+                                   f'to resume it anyway if its process is gone')
+            self.stdout.write(f'Resuming job {job.id} after {job.processed_members} of '
+                              f'{job.total_members} images')
+        job.copy_workers = workers
+        job.save()
+
+        job.run()
+        if job.status != 'DONE':
+            raise CommandError(f'Job {job.id} failed: {job.error}. '
+                               f'Run the command again to resume it')
+        job.evaluation.refresh_from_db()
+        self.stdout.write(f'Imported {job.evaluation.total_questions} questions, '
+                          f'{job.total_members} images, {job.total_bytes / 2 ** 20:.1f} MB '
+                          f'into evaluation {job.evaluation.id}')
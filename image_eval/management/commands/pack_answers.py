@@ -0,0 +1,43 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from image_eval.models import Evaluation, Session
+
+
+class Command(BaseCommand):
+    help = 'Moves answers of completed sessions into one packed value per session, or back. ' \
+           'Packed answers are exported and counted as before, but leave results feed; ' \
+           'unpacked ones get new ids and appear in the feed again, so feed consumers ' \
+           'see them twice. Answers are kept by question order, which must be unique.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('evaluation_ids', nargs='*', type=int,
+                            help='Evaluations whose sessions to convert, all by default')
+        parser.add_argument('--unpack', action='store_true',
+                            help='Move packed answers back into rows')
+
+    def handle(self, *args, evaluation_ids, unpack, **options):
+        evaluations = Evaluation.objects.order_by('id')
+        if evaluation_ids:
+            evaluations = evaluations.filter(id__in=evaluation_ids)
+
+        for evaluation in evaluations:
+            sessions = Session.objects \
+                .filter(evaluation=evaluation, completed_at__isnull=False,
+                        packed_answers__isnull=not unpack) \
+                .order_by('id')
+            converted = 0
+            for session in sessions.iterator():
+                # Each session separately, so the database isn't locked for long
+                try:
+                    with transaction.atomic():
+                        if unpack:
+                            session.unpack()
+                        else:
+                            session.pack()
+                except ValueError as e:
+                    raise CommandError(f'{e}, {converted} sessions of evaluation '
+                                       f'{evaluation.id} converted') from e
+                converted += 1
+            self.stdout.write(f'{evaluation.id}: {"unpacked" if unpack else "packed"} '
+                              f'{converted} sessions')
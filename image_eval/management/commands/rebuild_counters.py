@@ -0,0 +1,51 @@
+from django.core.management import BaseCommand, CommandError
+
+from image_eval.models import Evaluation, EvaluationCounter, AnswerCounter
+
+
+class Command(BaseCommand):
+    help = 'Recomputes answer counters of evaluations from recorded answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('evaluation_ids', nargs='*', type=int,
+                            help='Evaluations to rebuild, all by default')
+        parser.add_argument('--check', action='store_true',
+                            help="Only report evaluations whose counters don't match answers")
+
+    def handle(self, *args, evaluation_ids, check, **options):
+        evaluations = Evaluation.objects.order_by('id')
+        if evaluation_ids:
+            evaluations = evaluations.filter(id__in=evaluation_ids)
+
+        mismatched = 0
+        for evaluation in evaluations:
+            if check:
+                if not self.matches(evaluation):
+                    mismatched += 1
+                    self.stdout.write(self.style.ERROR(f'{evaluation.id}: counters mismatch'))
+            else:
+                EvaluationCounter.rebuild(evaluation)
+                self.stdout.write(f'{evaluation.id}: rebuilt')
+
+        if mismatched:
+            raise CommandError(f'{mismatched} evaluations have mismatched counters')
+
+    @staticmethod
+    def matches(evaluation: Evaluation) -> bool:
+        expected, expected_answers = EvaluationCounter.compute(evaluation)
+        actual = EvaluationCounter.objects.filter(evaluation=evaluation).first()
+        if actual is None:
+            return not expected_answers
+        if (actual.answers, actual.completed_sessions) != \
+                (expected.answers, expected.completed_sessions):
+            return False
+
+        actual_answers = set(
+            AnswerCounter.objects
+                .filter(question__evaluation=evaluation)
+                .exclude(answers=0, completed=0)
+                .values_list('question_id', 'answer', 'answers', 'completed')
+        )
+        return actual_answers == {
+            (c.question_id, c.answer, c.answers, c.completed) for c in expected_answers
+        }
@@ -0,0 +1,329 @@
+"""
+Per-request timings aggregated into histograms per view.
+
+Each worker process keeps histograms in memory and periodically dumps them into its
+own file in ``METRICS_DIR``, the metrics endpoint sums files of all processes.
+Files of exited processes are merged into ``ARCHIVE_FILE``, so they don't pile up.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template
+
+slow_logger = logging.getLogger('image_eval.slow_requests')
+
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERIES_BUCKETS = [1, 2, 3, 5, 10, 20, 50, 100]
+
+# Metric name -> (help, buckets)
+METRICS = {
+    'request_seconds': ('Wall time of requests', SECONDS_BUCKETS),
+    'db_queries': ('Database queries per request', QUERIES_BUCKETS),
+    'db_seconds': ('Time spent in database queries per request', SECONDS_BUCKETS),
+    'template_seconds': ('Time spent rendering templates per request', SECONDS_BUCKETS),
+}
+PREFIX = 'image_eval_'
+# Histograms of exited processes
+ARCHIVE_FILE = 'archive.json'
+# Queries kept for slow request log
+MAX_LOGGED_QUERIES = 50
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        # Last one counts values above all buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, counts: List[int], sum: float):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += sum
+
+    def dump(self) -> dict:
+        return dict(counts=self.counts, sum=self.sum)
+
+
+class Registry:
+    """
+    Histograms of the current process keyed by metric and view name
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.check_process()
+
+    def check_process(self):
+        """
+        Starts afresh in a process forked after the registry was created, like uWSGI workers
+        forked from the master, so each process writes only its own histograms to its own file
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.flushed_at = time.monotonic()
+        self.file_name = f'{self.pid}-{int(time.time() * 1000)}.json'
+
+    def observe(self, metric: str, view: str, value: float):
+        self.check_process()
+        with self.lock:
+            histogram = self.histograms.get((metric, view))
+            if histogram is None:
+                histogram = self.histograms[metric, view] = Histogram(METRICS[metric][1])
+            histogram.observe(value)
+
+    def dump(self) -> list:
+        self.check_process()
+        with self.lock:
+            return [[metric, view, histogram.dump()]
+                    for (metric, view), histogram in self.histograms.items()]
+
+    def flush(self, force=False):
+        """
+        Writes histograms into the process file and archives files of exited processes,
+        at most once in ``METRICS_FLUSH_INTERVAL``
+        """
+        self.check_process()
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        write_atomically(os.path.join(settings.METRICS_DIR, self.file_name), self.dump())
+        self.archive_exited()
+
+    def archive_exited(self):
+        """
+        Merges files of processes which are gone into ``ARCHIVE_FILE`` and removes them
+        """
+        with open(os.path.join(settings.METRICS_DIR, '.archive.lock'), 'w') as lock:
+            # Another process archiving the same files would count them twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = [name for name in os.listdir(settings.METRICS_DIR)
+                      if name.endswith('.json') and not process_alive(name)]
+            if not exited:
+                return
+
+            archive_path = os.path.join(settings.METRICS_DIR, ARCHIVE_FILE)
+            dumps = [read_dump(os.path.join(settings.METRICS_DIR, name))
+                     for name in [ARCHIVE_FILE] + exited]
+            write_atomically(archive_path, [
+                [metric, view, histogram.dump()]
+                for (metric, view), histogram in merge_dumps(dumps).items()
+            ])
+            for name in exited:
+                os.remove(os.path.join(settings.METRICS_DIR, name))
+
+    def collect(self) -> Dict[Tuple[str, str], Histogram]:
+        """
+        Sums histograms of all processes, including finished ones, so counters don't reset
+        on worker restarts
+        """
+        dumps = [self.dump()]
+        if os.path.isdir(settings.METRICS_DIR):
+            for name in os.listdir(settings.METRICS_DIR):
+                if name.endswith('.json') and name != self.file_name:
+                    dumps.append(read_dump(os.path.join(settings.METRICS_DIR, name)))
+        return merge_dumps(dumps)
+
+    def format_prometheus(self) -> str:
+        merged = self.collect()
+        lines = []
+        for metric, (help, buckets) in METRICS.items():
+            name = PREFIX + metric
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (_, view), histogram in sorted(
+                    (key, h) for key, h in merged.items() if key[0] == metric):
+                label = f'view="{escape_label(view)}"'
+                total = 0
+                for bound, count in zip(buckets + ['+Inf'], histogram.counts):
+                    total += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}}} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+def merge_dumps(dumps: List[list]) -> Dict[Tuple[str, str], Histogram]:
+    merged = {}
+    for dump in dumps:
+        for metric, view, data in dump:
+            if metric not in METRICS:
+                continue
+            histogram = merged.get((metric, view))
+            if histogram is None:
+                histogram = merged[metric, view] = Histogram(METRICS[metric][1])
+            histogram.merge(data['counts'], data['sum'])
+    return merged
+
+
+def read_dump(path: str) -> list:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Removed by archiving meanwhile
+        return []
+
+
+def write_atomically(path: str, dump: list):
+    # Readers must never see half-written file, temporary name is unique to the writer thread
+    temporary = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(dump, f)
+    os.replace(temporary, path)
+
+
+def process_alive(file_name: str) -> bool:
+    """
+    Whether the process which writes ``<pid>-<started ms>.json`` file is still running,
+    true for files not named so
+    """
+    try:
+        pid = int(file_name.split('-', 1)[0])
+    except ValueError:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+@atexit.register
+def flush_on_exit():
+    if registry.pid == os.getpid() and registry.histograms:
+        registry.flush(force=True)
+
+
+class RequestMetrics:
+    """
+    Database execute wrapper and template timer of a single request
+    """
+
+    def __init__(self, log_queries: bool):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        # (seconds, sql) of executed queries, when slow requests are logged
+        self.logged_queries: Optional[List[Tuple[float, str]]] = [] if log_queries else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if self.logged_queries is not None:
+                self.logged_queries.append((elapsed, sql))
+
+
+_current = threading.local()
+
+
+def current_request_metrics() -> Optional[RequestMetrics]:
+    return getattr(_current, 'metrics', None)
+
+
+class MetricsMiddleware:
+    """
+    Records wall time, database queries and template rendering time of each request
+    under its view name. Queries made while streaming response aren't counted.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics(settings.METRICS_SLOW_REQUEST_SECONDS is not None)
+        _current.metrics = metrics
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.metrics = None
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        registry.observe('request_seconds', view, elapsed)
+        registry.observe('db_queries', view, metrics.queries)
+        registry.observe('db_seconds', view, metrics.db_seconds)
+        registry.observe('template_seconds', view, metrics.template_seconds)
+        registry.flush()
+
+        if metrics.logged_queries is not None and elapsed >= settings.METRICS_SLOW_REQUEST_SECONDS:
+            log_slow_request(request, view, elapsed, metrics)
+        return response
+
+
+def log_slow_request(request, view: str, elapsed: float, metrics: RequestMetrics):
+    slowest = sorted(metrics.logged_queries, reverse=True)[:MAX_LOGGED_QUERIES]
+    slow_logger.warning(
+        '%s %s (%s) took %.3fs: %d queries %.3fs, templates %.3fs\n%s',
+        request.method, request.path, view, elapsed,
+        metrics.queries, metrics.db_seconds, metrics.template_seconds,
+        '\n'.join(f'{seconds:.4f}s {sql}' for seconds, sql in slowest)
+    )
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_request_metrics()
+        if metrics is None:
+            return super().render(context, request)
+
+        # Templates rendered by template tags are already timed by the outer one
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            if metrics.template_depth == 0:
+                metrics.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Django templates backend reporting rendering time to ``MetricsMiddleware``
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
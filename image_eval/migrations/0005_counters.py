@@ -0,0 +1,66 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q
+
+
+def count_answers(apps, schema_editor):
+    Evaluation = apps.get_model('image_eval', 'Evaluation')
+    Session = apps.get_model('image_eval', 'Session')
+    Assignment = apps.get_model('image_eval', 'Assignment')
+    AnswerCounter = apps.get_model('image_eval', 'AnswerCounter')
+    EvaluationCounter = apps.get_model('image_eval', 'EvaluationCounter')
+
+    for evaluation in Evaluation.objects.all():
+        answer_counters = [
+            AnswerCounter(**row)
+            for row in Assignment.objects
+                .filter(question__evaluation=evaluation)
+                .values('question_id', 'answer')
+                .order_by('question_id', 'answer')
+                .annotate(answers=Count('id'),
+                          completed=Count('id', filter=Q(session__completed_at__isnull=False)))
+        ]
+        AnswerCounter.objects.bulk_create(answer_counters)
+        EvaluationCounter.objects.create(
+            evaluation=evaluation,
+            answers=sum(c.answers for c in answer_counters),
+            completed_sessions=Session.objects
+                .filter(evaluation=evaluation, completed_at__isnull=False)
+                .count(),
+            version=1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0004_imagevariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvaluationCounter',
+            fields=[
+                ('evaluation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='image_eval.Evaluation')),
+                ('answers', models.IntegerField(default=0)),
+                ('completed_sessions', models.IntegerField(default=0)),
+                ('version', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnswerCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.IntegerField()),
+                ('answers', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='image_eval.Question')),
+            ],
+            options={
+                'unique_together': {('question', 'answer')},
+            },
+        ),
+        migrations.RunPython(count_answers, migrations.RunPython.noop),
+    ]
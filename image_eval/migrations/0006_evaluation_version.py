@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluation',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
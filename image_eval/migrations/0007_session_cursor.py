@@ -0,0 +1,62 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:27
+
+from django.db import migrations, models
+from django.db.models import F, Max, Min
+
+
+def drop_duplicate_answers(apps, schema_editor):
+    """
+    Keeps the first answer of each session to each question and uncounts the rest
+    """
+    Assignment = apps.get_model('image_eval', 'Assignment')
+    AnswerCounter = apps.get_model('image_eval', 'AnswerCounter')
+    EvaluationCounter = apps.get_model('image_eval', 'EvaluationCounter')
+
+    first_ids = Assignment.objects \
+        .values('session_id', 'question_id') \
+        .annotate(first_id=Min('id')) \
+        .values('first_id')
+    duplicates = Assignment.objects.exclude(id__in=first_ids).select_related('session')
+    for duplicate in duplicates:
+        completed = int(duplicate.session.completed_at is not None)
+        AnswerCounter.objects \
+            .filter(question_id=duplicate.question_id, answer=duplicate.answer) \
+            .update(answers=F('answers') - 1, completed=F('completed') - completed)
+        EvaluationCounter.objects \
+            .filter(evaluation_id=duplicate.session.evaluation_id) \
+            .update(answers=F('answers') - 1, version=F('version') + 1)
+        duplicate.delete()
+
+
+def fill_next_order(apps, schema_editor):
+    Session = apps.get_model('image_eval', 'Session')
+    for session in Session.objects \
+            .annotate(max_order=Max('assignment__question__order')) \
+            .filter(max_order__isnull=False):
+        session.next_order = session.max_order + 1
+        session.save(update_fields=['next_order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0006_evaluation_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='next_order',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(drop_duplicate_answers, migrations.RunPython.noop),
+        migrations.RunPython(fill_next_order, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='assignment',
+            unique_together={('session', 'question')},
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['evaluation', 'completed_at'], name='session_evaluation_completed'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:37
+
+import hashlib
+
+from django.db import migrations, models
+import image_eval.models.questions
+
+
+def store_flip(apps, schema_editor):
+    """
+    Keeps sides of existing questions as they were derived from question id
+    """
+    ImageSelectionQuestion = apps.get_model('image_eval', 'ImageSelectionQuestion')
+    flipped = [
+        id for id in ImageSelectionQuestion.objects.values_list('question_ptr_id', flat=True)
+        if int(hashlib.sha1(f'{id}'.encode()).hexdigest(), 16) % 2 == 0
+    ]
+    ImageSelectionQuestion.objects.update(flip=False)
+    for start in range(0, len(flipped), 500):
+        ImageSelectionQuestion.objects \
+            .filter(question_ptr_id__in=flipped[start:start + 500]) \
+            .update(flip=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0007_session_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluation',
+            name='shuffle',
+            field=models.BooleanField(default=False, help_text='Shuffle question order and image sides per session'),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='flip',
+            field=models.BooleanField(default=image_eval.models.questions.random_flip),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='seed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(store_flip, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:40
+
+import os
+
+from django.db import migrations, models
+from PIL import Image
+
+
+def record_dimensions(apps, schema_editor):
+    """
+    Reads headers of existing question images, missing or broken ones are left unknown
+    """
+    models_fields = [
+        ('ImageClassificationQuestion', ['image']),
+        ('ImageSelectionQuestion', ['left_image', 'right_image']),
+    ]
+    for model_name, fields in models_fields:
+        model = apps.get_model('image_eval', model_name)
+        for question in model.objects.iterator():
+            for field in fields:
+                image = getattr(question, field)
+                try:
+                    with Image.open(image.path) as opened:
+                        setattr(question, f'{field}_width', opened.width)
+                        setattr(question, f'{field}_height', opened.height)
+                        setattr(question, f'{field}_format', opened.format)
+                    setattr(question, f'{field}_size', os.path.getsize(image.path))
+                except (OSError, ValueError):
+                    continue
+            question.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0008_stored_flip'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageclassificationquestion',
+            name='image_format',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='imageclassificationquestion',
+            name='image_height',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageclassificationquestion',
+            name='image_size',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageclassificationquestion',
+            name='image_width',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='left_image_format',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='left_image_height',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='left_image_size',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='left_image_width',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='right_image_format',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='right_image_height',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='right_image_size',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='right_image_width',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(record_dimensions, migrations.RunPython.noop),
+    ]
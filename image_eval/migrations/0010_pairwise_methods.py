@@ -0,0 +1,54 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0009_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluation',
+            name='questions_per_session',
+            field=models.IntegerField(blank=True, help_text='Number of questions in a session, all by default', null=True),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='pending_question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='image_eval.Question'),
+        ),
+        migrations.AlterField(
+            model_name='evaluation',
+            name='type',
+            field=models.CharField(choices=[('SEL', 'Image selection'), ('CLS', 'Image classification'), ('PAIR', 'Pairwise method comparison')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Method',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('mean', models.FloatField(default=0.0)),
+                ('variance', models.FloatField(default=1.0)),
+                ('comparisons', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('evaluation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='methods', to='image_eval.Evaluation')),
+            ],
+            options={
+                'unique_together': {('evaluation', 'name')},
+            },
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='left_method',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='image_eval.Method'),
+        ),
+        migrations.AddField(
+            model_name='imageselectionquestion',
+            name='right_method',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='image_eval.Method'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:45
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_responses(apps, schema_editor):
+    Question = apps.get_model('image_eval', 'Question')
+    for question in Question.objects.annotate(answers=Count('assignment')).filter(answers__gt=0):
+        Question.objects.filter(id=question.id).update(responses=question.answers)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0010_pairwise_methods'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evaluation',
+            name='allocate',
+            field=models.BooleanField(default=False, help_text='Serve least answered questions first and stop asking ones whose answer is already clear'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='responses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='retired',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['evaluation', 'retired', 'responses'], name='question_allocation'),
+        ),
+        migrations.RunPython(count_responses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_evaluation(apps, schema_editor):
+    Session = apps.get_model('image_eval', 'Session')
+    Assignment = apps.get_model('image_eval', 'Assignment')
+    for id, evaluation_id in Session.objects.values_list('id', 'evaluation_id'):
+        Assignment.objects.filter(session_id=id).update(evaluation_id=evaluation_id)
+
+
+def number_completions(apps, schema_editor):
+    Session = apps.get_model('image_eval', 'Session')
+    seq = {}
+    for id, evaluation_id in Session.objects \
+            .filter(completed_at__isnull=False) \
+            .order_by('completed_at', 'id') \
+            .values_list('id', 'evaluation_id'):
+        seq[evaluation_id] = seq.get(evaluation_id, 0) + 1
+        Session.objects.filter(id=id).update(completion_seq=seq[evaluation_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0011_allocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='evaluation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='image_eval.Evaluation'),
+        ),
+        migrations.RunPython(fill_evaluation, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='assignment',
+            name='evaluation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='image_eval.Evaluation'),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='completion_seq',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['evaluation', 'completion_seq'], name='session_completion_seq'),
+        ),
+        migrations.RunPython(number_completions, migrations.RunPython.noop),
+    ]
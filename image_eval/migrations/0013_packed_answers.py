@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0012_results_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='packed_answers',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0013_packed_answers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='copy_workers',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='source_path',
+            field=models.CharField(blank=True, max_length=4096),
+        ),
+        migrations.AlterField(
+            model_name='ingestionjob',
+            name='archive',
+            field=models.FileField(blank=True, upload_to='ingest/'),
+        ),
+    ]
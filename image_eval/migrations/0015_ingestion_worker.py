@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_eval', '0014_server_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='worker_pid',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
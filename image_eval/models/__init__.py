@@ -1,2 +1,7 @@
+from .blobs import *
 from .questions import *
+from .methods import *
 from .sessions import *
+from .results import *
+from .variants import *
+from .ingestion import *
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete
+
+
+class Blob(models.Model):
+    """
+    Reference counter of a content-addressed media file, see ``ContentAddressedStorage``
+    """
+    name = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField()
+    refs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def acquire(name: str, size: int):
+        if Blob.objects.filter(name=name).update(refs=F('refs') + 1):
+            return
+        try:
+            with transaction.atomic():
+                Blob.objects.create(name=name, size=size, refs=1)
+        except IntegrityError:
+            # Created concurrently
+            Blob.objects.filter(name=name).update(refs=F('refs') + 1)
+
+    @staticmethod
+    def lock():
+        """
+        Takes the database write lock for the rest of current transaction,
+        which deferred transactions only take at their first write
+        """
+        if connection.vendor == 'sqlite' and not settings.SQLITE_IMMEDIATE_TRANSACTIONS:
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {Blob._meta.db_table} SET id = id WHERE 0')
+
+    @staticmethod
+    def release(name: str) -> bool:
+        """
+        Drops one reference to the blob
+
+        :return: True if nobody references blob anymore, or it wasn't tracked at all
+        """
+        Blob.objects.filter(name=name).update(refs=F('refs') - 1)
+        deleted, _ = Blob.objects.filter(name=name, refs__lte=0).delete()
+        return deleted > 0 or not Blob.objects.filter(name=name).exists()
+
+
+def release_files(sender, instance, **kwargs):
+    """
+    Deletes files of deleted model instance from their storage,
+    so cascade deletion of evaluations doesn't leave orphaned media
+    """
+    for field in sender._meta.concrete_fields:
+        if isinstance(field, models.FileField):
+            file = getattr(instance, field.attname)
+            if file:
+                file.storage.delete(file.name)
+
+
+def release_files_on_delete(model):
+    post_delete.connect(release_files, sender=model)
+    return model
+
+
+__all__ = ['Blob']
@@ -0,0 +1,650 @@
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from datetime import timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Type
+from zipfile import ZipFile, ZipInfo
+
+import yaml
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.files.base import File
+from django.db import models, transaction, close_old_connections, connection
+from django.db.models import QuerySet
+from django.forms import ModelForm, FileField, CharField
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from .. import imaging
+from ..archives import open_archive
+from ..bulk_admin import delete_in_chunks, summarize_deletion
+from .blobs import Blob, release_files_on_delete
+from .methods import Method
+from .questions import Evaluation, Question, ImageSelectionQuestion, ImageClassificationQuestion
+from .results import AnswerCounter
+from .sessions import Session, Assignment
+from .variants import make_variants
+
+logger = logging.getLogger(__name__)
+
+# Number of archive members decoded by a worker process at once
+INSPECTION_BATCH_SIZE = 32
+
+
+class QuestionSpec(NamedTuple):
+    """
+    Question planned from archive structure, but not created yet
+    """
+    model: Type[Question]
+    order: int
+    # Image field name -> (archive member, storage file name, extension is added
+    # once the image format is known)
+    files: Dict[str, Tuple[ZipInfo, str]]
+    # Other non-file field values
+    fields: Dict[str, object]
+
+
+@release_files_on_delete
+class IngestionJob(models.Model):
+    STATUSES = {
+        'PENDING': 'Pending',
+        'RUNNING': 'Running',
+        'DONE': 'Done',
+        'FAILED': 'Failed'
+    }
+    # Job which didn't start or report progress for that long is considered lost,
+    # as queued jobs are gone when the server restarts
+    STALE_AFTER = timedelta(minutes=10)
+    # Heartbeats coming sooner after the last save are skipped
+    HEARTBEAT_INTERVAL = timedelta(seconds=30)
+
+    evaluation = models.ForeignKey(Evaluation, on_delete=models.CASCADE,
+                                   related_name='ingestion_jobs')
+    # Uploaded archive, or path of archive or directory on the server, see import_evaluation
+    archive = models.FileField(upload_to='ingest/', blank=True)
+    source_path = models.CharField(max_length=4096, blank=True)
+    # Threads copying images into storage, INGESTION_COPY_WORKERS by default
+    copy_workers = models.IntegerField(null=True, blank=True)
+    question_text = models.CharField(max_length=1000)
+    status = models.CharField(max_length=10, choices=STATUSES.items(), default='PENDING')
+    error = models.TextField(blank=True)
+    # Process which runs the job, so a stale job it still runs isn't resumed elsewhere
+    worker_pid = models.IntegerField(null=True, blank=True)
+
+    total_members = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    processed_members = models.IntegerField(default=0)
+    processed_bytes = models.BigIntegerField(default=0)
+    processed_questions = models.IntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'Ingestion of {self.evaluation}'
+
+    @property
+    def archive_path(self) -> str:
+        return self.source_path or self.archive.path
+
+    @property
+    def stale(self) -> bool:
+        return self.status in ('PENDING', 'RUNNING') \
+            and self.updated_at < timezone.now() - self.STALE_AFTER
+
+    @property
+    def abandoned(self) -> bool:
+        """
+        Stale and not running in a live process, so it isn't going to finish by itself
+        """
+        return self.stale and not (self.status == 'RUNNING' and self.worker_pid is not None
+                                   and process_running(self.worker_pid))
+
+    @property
+    def eta(self) -> Optional[timedelta]:
+        if self.status != 'RUNNING' or not self.processed_bytes:
+            return None
+        elapsed = timezone.now() - self.started_at
+        left = self.total_bytes - self.processed_bytes
+        return elapsed * (left / self.processed_bytes)
+
+    def enqueue(self):
+        """
+        Schedules job on the local worker pool once the current transaction is committed
+        """
+        job_id = self.id
+        transaction.on_commit(lambda: get_executor().submit(run_job, job_id))
+
+    def begin(self, specs: List[QuestionSpec]):
+        self.total_members = sum(len(spec.files) for spec in specs)
+        self.total_bytes = sum(
+            info.file_size for spec in specs for info, _ in spec.files.values()
+        )
+        self.save()
+
+    def advance(self, specs: List[QuestionSpec]):
+        self.processed_questions += len(specs)
+        self.processed_members += sum(len(spec.files) for spec in specs)
+        self.processed_bytes += sum(
+            info.file_size for spec in specs for info, _ in spec.files.values()
+        )
+        self.save()
+
+    def heartbeat(self):
+        """
+        Marks job alive during long steps which don't advance it, see ``stale``
+        """
+        if timezone.now() - self.updated_at >= self.HEARTBEAT_INTERVAL:
+            self.save(update_fields=['updated_at'])
+
+    def run(self):
+        self.status = 'RUNNING'
+        self.error = ''
+        self.worker_pid = os.getpid()
+        self.started_at = timezone.now()
+        self.save()
+
+        try:
+            evaluation = self.evaluation
+            zip_parser = EvaluationAdmin.ZIP_PARSERS[evaluation.type]
+            if self.source_path:
+                total_questions = zip_parser(self.source_path, self.question_text, evaluation,
+                                             self)
+            else:
+                with self.archive.open('rb') as archive:
+                    total_questions = zip_parser(archive, self.question_text, evaluation, self)
+            make_variants(evaluation.images(), self.heartbeat)
+
+            with transaction.atomic():
+                Evaluation.bump_version(evaluation.id, total_questions=total_questions)
+                self.status = 'DONE'
+                self.finished_at = timezone.now()
+                self.save()
+            if self.archive:
+                self.archive.delete()
+        except Exception as e:
+            logger.exception('Ingestion job %s failed', self.id)
+            self.status = 'FAILED'
+            self.error = f'{e}: {e.__cause__}' if e.__cause__ else str(e)
+            self.finished_at = timezone.now()
+            self.save()
+
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS,
+                                       thread_name_prefix='ingestion')
+    return _executor
+
+
+def process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_job(job_id: int):
+    close_old_connections()
+    try:
+        # Job retried while still queued is queued twice, only the first run takes it
+        if not IngestionJob.objects.filter(id=job_id, status='PENDING') \
+                .update(status='RUNNING', worker_pid=os.getpid(), updated_at=timezone.now()):
+            return
+        IngestionJob.objects.get(id=job_id).run()
+    finally:
+        connection.close()
+
+
+class EvaluationForm(ModelForm):
+    images = FileField()
+    question = CharField(max_length=1000)
+
+
+@admin.register(Evaluation)
+class EvaluationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'title', 'type', 'total_questions', 'created_at']
+    ordering = ['created_at']
+    actions = ['export_result', 'export_result_csv', 'export_rankings', 'export_analysis',
+               'summarize_answers']
+    readonly_fields = ['created_at', 'total_questions', 'version', 'images_summary']
+    list_editable = ['title']
+    list_display_links = None
+    form = EvaluationForm
+
+    def get_readonly_fields(self, request, obj=None):
+        # Changing how questions are ordered would break cursors of started sessions
+        if obj is not None:
+            return self.readonly_fields + ['shuffle', 'allocate']
+        return self.readonly_fields
+
+    def images_summary(self, evaluation: Evaluation):
+        if evaluation.id is None:
+            return '-'
+        return '; '.join(
+            f"{format}: {stats['count']} images, {stats['size'] / 2 ** 20:.1f} MB, "
+            f"{stats['min_width']}-{stats['max_width']} x "
+            f"{stats['min_height']}-{stats['max_height']} px"
+            for format, stats in sorted(evaluation.image_stats().items())
+        ) or '-'
+
+    def get_deleted_objects(self, objs, request):
+        return summarize_deletion(objs, self.opts)
+
+    def delete_model(self, request, obj: Evaluation):
+        self.delete_answers(Evaluation.objects.filter(id=obj.id))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset: QuerySet):
+        self.delete_answers(queryset)
+        super().delete_queryset(request, queryset)
+
+    @staticmethod
+    def delete_answers(evaluations: QuerySet):
+        """
+        Deletes answers and sessions in chunks, leaving only questions
+        to the cascade which has to load them for file cleanup
+        """
+        delete_in_chunks(Assignment.objects.filter(evaluation__in=evaluations))
+        delete_in_chunks(AnswerCounter.objects.filter(question__evaluation__in=evaluations))
+        delete_in_chunks(Session.objects.filter(evaluation__in=evaluations))
+
+    def export_result(self, request, queryset: QuerySet):
+        return redirect('export_result', id=queryset.all()[0].id)
+
+    def export_result_csv(self, request, queryset: QuerySet):
+        return redirect('export_result_csv', id=queryset.all()[0].id)
+
+    def export_rankings(self, request, queryset: QuerySet):
+        return redirect('export_rankings', id=queryset.all()[0].id)
+
+    def export_analysis(self, request, queryset: QuerySet):
+        return redirect('export_analysis', id=queryset.all()[0].id)
+
+    def summarize_answers(self, request, queryset: QuerySet):
+        # Analysis imports models
+        from .. import analysis
+
+        for evaluation in queryset:
+            self.message_user(request, analysis.summary(evaluation))
+
+    @transaction.atomic
+    def save_model(self, request, obj, form: ModelForm, change):
+        if change:
+            super().save_model(request, obj, form, True)
+        else:
+            data = form.cleaned_data
+            evaluation: Evaluation = Evaluation(title=data['title'],
+                                                type=data['type'],
+                                                shuffle=data['shuffle'],
+                                                questions_per_session=data['questions_per_session'],
+                                                allocate=data['allocate'],
+                                                created_at=timezone.now(),
+                                                total_questions=0)
+            evaluation.save()
+
+            job = IngestionJob(evaluation=evaluation, archive=data['images'],
+                               question_text=data['question'])
+            job.save()
+            job.enqueue()
+
+            self.message_user(request, 'Archive is queued for ingestion, '
+                                       'see Ingestion jobs for progress')
+
+    @staticmethod
+    def make_selection_questions_from_zip(zip_file_stream, question_text, evaluation,
+                                          job: IngestionJob = None):
+        return EvaluationAdmin.make_questions_from_zip(
+            zip_file_stream, question_text, evaluation,
+            EvaluationAdmin.plan_selection_questions, job
+        )
+
+    @staticmethod
+    def make_classification_questions_from_zip(zip_file_stream, question_text, evaluation,
+                                               job: IngestionJob = None):
+        return EvaluationAdmin.make_questions_from_zip(
+            zip_file_stream, question_text, evaluation,
+            EvaluationAdmin.plan_classification_questions, job
+        )
+
+    @staticmethod
+    def make_pair_questions_from_zip(zip_file_stream, question_text, evaluation,
+                                     job: IngestionJob = None):
+        return EvaluationAdmin.make_questions_from_zip(
+            zip_file_stream, question_text, evaluation,
+            EvaluationAdmin.plan_pair_questions, job
+        )
+
+    @staticmethod
+    def make_questions_from_zip(zip_file_stream, question_text, evaluation, planner,
+                                job: IngestionJob = None):
+        """
+        Creates questions planned by ``planner`` in chunks of ``INGESTION_CHUNK_SIZE``,
+        each committed in its own transaction together with ``job`` progress.
+        Questions already counted by ``job`` are skipped, so failed job may be rerun.
+
+        :param zip_file_stream: ZIP file stream, or path of ZIP file or directory
+        """
+        try:
+            with open_archive(zip_file_stream) as images:
+                index = EvaluationAdmin.index_zip(images)
+                specs = planner(images, index, evaluation)
+
+                if len(specs) == 0:
+                    raise Exception("There must be at least one question")
+
+                start = 0
+                if job is not None:
+                    job.begin(specs)
+                    start = job.processed_questions
+
+                pending = specs[start:]
+                inspected = EvaluationAdmin.inspect_images(
+                    images, pending, job.archive_path if job is not None else None,
+                    job.heartbeat if job is not None else None
+                )
+                pending = [EvaluationAdmin.describe_images(spec, inspected) for spec in pending]
+
+                workers = settings.INGESTION_COPY_WORKERS
+                if job is not None and job.copy_workers:
+                    workers = job.copy_workers
+                chunk_size = settings.INGESTION_CHUNK_SIZE
+                with ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix='ingestion-copy') as copier:
+                    for chunk_start in range(0, len(pending), chunk_size):
+                        chunk = pending[chunk_start:chunk_start + chunk_size]
+                        files = EvaluationAdmin.copy_members(
+                            images, chunk, copier, job.heartbeat if job is not None else None
+                        )
+                        with transaction.atomic():
+                            # Evaluation is published with its total once all questions are in
+                            Question.bulk_create([
+                                EvaluationAdmin.build_question(images, spec, spec_files,
+                                                               question_text, evaluation)
+                                for spec, spec_files in zip(chunk, files)
+                            ], update_totals=False)
+                            if job is not None:
+                                job.advance(chunk)
+            return len(specs)
+        except Exception as e:
+            raise Exception('Zip parsing failed. Most likely the structure is wrong') from e
+
+    @staticmethod
+    def inspect_images(zip: ZipFile, specs: List[QuestionSpec],
+                       archive_path: str = None,
+                       heartbeat: Callable[[], None] = None) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Decodes all images of ``specs``, on a pool of ``IMAGE_VARIANT_WORKERS`` processes
+        if the archive is a file at ``archive_path``
+
+        :param heartbeat: called after each batch of ``INSPECTION_BATCH_SIZE`` images
+        :return: member name -> (format, width, height)
+        :raises Exception: listing members which aren't valid images
+        """
+        names = [info.filename for spec in specs for info, _ in spec.files.values()]
+        batches = [names[start:start + INSPECTION_BATCH_SIZE]
+                   for start in range(0, len(names), INSPECTION_BATCH_SIZE)]
+        results = []
+        with ExitStack() as stack:
+            if archive_path is None:
+                inspected = (imaging.inspect_members(zip, batch) for batch in batches)
+            else:
+                pool = stack.enter_context(
+                    ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+                )
+                inspected = pool.map(partial(imaging.inspect_archive, archive_path), batches)
+            for batch in inspected:
+                results.extend(batch)
+                if heartbeat is not None:
+                    heartbeat()
+
+        errors = [f'{name}: {error}' for name, _, error in results if error is not None]
+        if errors:
+            raise Exception(f'{len(errors)} archive members are not valid images, '
+                            + '; '.join(errors[:10]) + ('; ...' if len(errors) > 10 else ''))
+        return {name: info for name, info, _ in results}
+
+    @staticmethod
+    def describe_images(spec: QuestionSpec,
+                        inspected: Dict[str, Tuple[str, int, int]]) -> QuestionSpec:
+        """
+        Adds image dimensions, format and size to question fields
+        and extension matching the format to file names
+        """
+        files = {}
+        fields = dict(spec.fields)
+        for field, (info, name) in spec.files.items():
+            format, width, height = inspected[info.filename]
+            files[field] = (info, name + imaging.EXTENSIONS[format])
+            fields[f'{field}_width'] = width
+            fields[f'{field}_height'] = height
+            fields[f'{field}_format'] = format
+            fields[f'{field}_size'] = info.file_size
+        return spec._replace(files=files, fields=fields)
+
+    @staticmethod
+    def copy_members(zip: ZipFile, specs: List[QuestionSpec], copier: ThreadPoolExecutor,
+                     heartbeat: Callable[[], None] = None) -> List[Dict[str, Tuple[str, int]]]:
+        """
+        Writes files of ``specs`` into storage on ``copier`` threads.
+        Their blobs are acquired by ``build_question`` in the transaction creating questions.
+
+        :param heartbeat: called as files of each spec are written
+        :return: field name -> (stored name, size) for each spec
+        """
+        copies = [
+            {
+                field: copier.submit(EvaluationAdmin.copy_member, zip, info, spec.model, field,
+                                     name)
+                for field, (info, name) in spec.files.items()
+            }
+            for spec in specs
+        ]
+        files = []
+        for spec_copies in copies:
+            files.append({field: copy.result() for field, copy in spec_copies.items()})
+            if heartbeat is not None:
+                heartbeat()
+        return files
+
+    @staticmethod
+    def copy_member(zip: ZipFile, info: ZipInfo, model: Type[Question], field: str,
+                    name: str) -> Tuple[str, int]:
+        file_field = model._meta.get_field(field)
+        with EvaluationAdmin.open_member(zip, info, name) as member:
+            return file_field.storage.write_content(file_field.generate_filename(None, name),
+                                                    member)
+
+    @staticmethod
+    def build_question(zip: ZipFile, spec: QuestionSpec, files: Dict[str, Tuple[str, int]],
+                       question_text, evaluation) -> Question:
+        """
+        Acquires blobs of question files written by ``copy_members``
+        and returns unsaved question referring to them
+        """
+        for field, (name, size) in files.items():
+            Blob.acquire(name, size)
+            if not spec.model._meta.get_field(field).storage.exists(name):
+                # Deletion dropped the last other reference of existing file after it was
+                # found in storage, write it again now that the reference is held
+                info, member_name = spec.files[field]
+                EvaluationAdmin.copy_member(zip, info, spec.model, field, member_name)
+        return spec.model(
+            evaluation=evaluation, text=question_text,
+            order=spec.order,
+            **spec.fields,
+            **{field: name for field, (name, _) in files.items()}
+        )
+
+    @staticmethod
+    def plan_selection_questions(zip: ZipFile, index: Dict[str, ZipInfo],
+                                 evaluation) -> List[QuestionSpec]:
+        # Remove all prefixes and exts to match names
+        # proposed/first.jpg -> first
+        baseline_images = EvaluationAdmin.get_members_by_name(index, 'baseline/')
+        proposed_images = EvaluationAdmin.get_members_by_name(index, 'proposed/')
+
+        if baseline_images.keys() != proposed_images.keys():
+            raise Exception(
+                "Proposed and baseline image sets doesn't match"
+            )
+
+        return [
+            QuestionSpec(
+                model=ImageSelectionQuestion,
+                order=no,
+                files={
+                    'left_image': (baseline_images[name], f'{evaluation.id}_{no}_l'),
+                    'right_image': (proposed_images[name], f'{evaluation.id}_{no}_r'),
+                },
+                fields={}
+            )
+            for no, name in enumerate(sorted(baseline_images.keys()))
+        ]
+
+    @staticmethod
+    def plan_pair_questions(zip: ZipFile, index: Dict[str, ZipInfo],
+                            evaluation) -> List[QuestionSpec]:
+        """
+        Each top level folder holds images made by one method, questions compare
+        every pair of methods on every image. Which pairs get shown is decided
+        while answering, see ``image_eval.views.scheduling``.
+        """
+        folders = sorted({name.split('/', 1)[0] for name in index if '/' in name})
+        if len(folders) < 2:
+            raise Exception('There must be at least two method folders')
+
+        images = {
+            folder: EvaluationAdmin.get_members_by_name(index, f'{folder}/')
+            for folder in folders
+        }
+        names = sorted(images[folders[0]].keys())
+        for folder in folders[1:]:
+            if images[folder].keys() != set(names):
+                raise Exception(f"Image sets of {folders[0]} and {folder} don't match")
+
+        # Rerun of failed job finds methods created already
+        methods = [
+            Method.objects.get_or_create(evaluation=evaluation, name=folder)[0]
+            for folder in folders
+        ]
+        pairs = [(left, right) for no, left in enumerate(methods) for right in methods[no + 1:]]
+
+        return [
+            QuestionSpec(
+                model=ImageSelectionQuestion,
+                order=no,
+                files={
+                    'left_image': (images[left.name][name], f'{evaluation.id}_{no}_l'),
+                    'right_image': (images[right.name][name], f'{evaluation.id}_{no}_r'),
+                },
+                fields={'left_method_id': left.id, 'right_method_id': right.id}
+            )
+            for no, (name, (left, right)) in enumerate(
+                (name, pair) for name in names for pair in pairs
+            )
+        ]
+
+    @staticmethod
+    def plan_classification_questions(zip: ZipFile, index: Dict[str, ZipInfo],
+                                      evaluation) -> List[QuestionSpec]:
+        image_names = EvaluationAdmin.get_fnames_with_prefix(index, 'images/')
+
+        with zip.open(index['answers.yml']) as yml_stream:
+            answers = json.dumps(yaml.safe_load(yml_stream))
+
+        return [
+            QuestionSpec(
+                model=ImageClassificationQuestion,
+                order=no,
+                files={'image': (index[name], f'{evaluation.id}_{no}')},
+                fields={'answers': answers}
+            )
+            for no, name in enumerate(image_names)
+        ]
+
+    @staticmethod
+    def index_zip(zip: ZipFile) -> Dict[str, ZipInfo]:
+        """
+        Walks the archive directory once, so member lookups don't rescan ``zip.filelist``
+        """
+        return {item.filename: item for item in zip.infolist() if not item.is_dir()}
+
+    @staticmethod
+    def get_fnames_with_prefix(index: Dict[str, ZipInfo], prefix: str) -> List[str]:
+        return [name for name in index if name.startswith(prefix) and len(name) > len(prefix)]
+
+    @staticmethod
+    def get_members_by_name(index: Dict[str, ZipInfo], prefix: str) -> Dict[str, ZipInfo]:
+        """
+        Maps member names stripped of prefix and extension to their entries:
+        ``proposed/first.jpg -> first``
+        """
+        return {
+            name[len(prefix):].rsplit('.', 1)[0]: index[name]
+            for name in EvaluationAdmin.get_fnames_with_prefix(index, prefix)
+        }
+
+    @staticmethod
+    def open_member(zip: ZipFile, info: ZipInfo, name: str) -> File:
+        """
+        Wraps archive member into a lazy ``File``, so storage copies it chunk by chunk
+        instead of reading it into memory
+        """
+        member = File(zip.open(info), name)
+        member.size = info.file_size
+        return member
+
+
+EvaluationAdmin.ZIP_PARSERS = {
+    'SEL': EvaluationAdmin.make_selection_questions_from_zip,
+    'CLS': EvaluationAdmin.make_classification_questions_from_zip,
+    'PAIR': EvaluationAdmin.make_pair_questions_from_zip,
+}
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'evaluation', 'status', 'members', 'megabytes', 'eta',
+                    'created_at', 'finished_at', 'error']
+    list_filter = ['status']
+    list_select_related = ['evaluation']
+    ordering = ['-created_at']
+    actions = ['retry']
+    readonly_fields = [f.name for f in IngestionJob._meta.fields]
+
+    def members(self, job: IngestionJob):
+        return f'{job.processed_members}/{job.total_members}'
+
+    def megabytes(self, job: IngestionJob):
+        return f'{job.processed_bytes / 2 ** 20:.1f}/{job.total_bytes / 2 ** 20:.1f}'
+
+    def retry(self, request, queryset: QuerySet):
+        retried = 0
+        for job in queryset:
+            if job.status == 'FAILED' or job.abandoned:
+                job.status = 'PENDING'
+                job.save()
+                job.enqueue()
+                retried += 1
+        self.message_user(request, f'{retried} jobs are queued again', messages.INFO)
+
+    retry.short_description = 'Resume failed or stale jobs'
+
+    def has_add_permission(self, request):
+        return False
+
+
+__all__ = ['IngestionJob']
@@ -0,0 +1,82 @@
+from typing import List
+
+from django.contrib import admin
+from django.db import models
+from django.db.models import F
+
+from .. import ranking
+from .questions import Evaluation
+
+
+class Method(models.Model):
+    """
+    Image processing method compared in pairwise evaluation,
+    with its online rating, see ``image_eval.ranking``
+    """
+    evaluation = models.ForeignKey(Evaluation, models.CASCADE, related_name='methods')
+    name = models.CharField(max_length=100)
+    mean = models.FloatField(default=ranking.PRIOR_MEAN)
+    variance = models.FloatField(default=ranking.PRIOR_VARIANCE)
+    comparisons = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('evaluation', 'name')]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def rating(self) -> ranking.Rating:
+        return self.mean, self.variance
+
+    @staticmethod
+    def record_comparison(winner_id: int, loser_id: int):
+        """
+        Updates ratings once ``winner_id`` method was preferred. Must be called in transaction.
+        """
+        methods = Method.objects.in_bulk([winner_id, loser_id])
+        winner, loser = methods[winner_id], methods[loser_id]
+        (winner.mean, winner.variance), (loser.mean, loser.variance) = \
+            ranking.update(winner.rating, loser.rating)
+        for method, won in [(winner, 1), (loser, 0)]:
+            Method.objects.filter(id=method.id).update(
+                mean=method.mean, variance=method.variance,
+                comparisons=F('comparisons') + 1, wins=F('wins') + won
+            )
+
+    @staticmethod
+    def rankings(evaluation: Evaluation) -> List[dict]:
+        rankings = []
+        for method in Method.objects.filter(evaluation=evaluation).order_by('-mean'):
+            low, high = ranking.confidence_interval(method.rating)
+            rankings.append(dict(
+                method=method.name,
+                mean=method.mean,
+                ci_low=low,
+                ci_high=high,
+                comparisons=method.comparisons,
+                wins=method.wins,
+            ))
+        return rankings
+
+
+@admin.register(Method)
+class MethodAdmin(admin.ModelAdmin):
+    list_display = ['name', 'evaluation', 'mean', 'ci', 'comparisons', 'wins']
+    list_filter = ['evaluation']
+    list_select_related = ['evaluation']
+    ordering = ['evaluation', '-mean']
+    readonly_fields = [f.name for f in Method._meta.fields]
+
+    def ci(self, method: Method):
+        low, high = ranking.confidence_interval(method.rating)
+        return f'{low:.2f} .. {high:.2f}'
+
+    ci.short_description = '95% interval'
+
+    def has_add_permission(self, request):
+        return False
+
+
+__all__ = ['Method']
@@ -1,46 +1,201 @@
-import hashlib
 import json
-from typing import List
-from zipfile import ZipFile
-
-import yaml
-from django.contrib import admin
-from django.core.files.base import ContentFile
-from django.db import models, transaction
-from django.db.models import QuerySet
-from django.forms import ModelForm, FileField, CharField
-from django.shortcuts import redirect
-from django.utils import timezone
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import models, transaction, connection
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.signals import post_save, post_delete
+from django.db.models.fields.files import FieldFile
 from model_utils.managers import InheritanceManager
 
+from .blobs import release_files_on_delete
+
 
 class Evaluation(models.Model):
     TYPES = {
         'SEL': 'Image selection',
-        'CLS': 'Image classification'
+        'CLS': 'Image classification',
+        'PAIR': 'Pairwise method comparison',
     }
+    # Types whose next question is picked from answers given so far instead of going in order
+    ADAPTIVE_TYPES = ['PAIR']
 
     title = models.CharField(max_length=100)
     created_at = models.DateTimeField()
     type = models.CharField(max_length=10, choices=TYPES.items())
     total_questions = models.IntegerField()
+    # Bumped whenever questions change, so their in-process caches get invalidated
+    version = models.IntegerField(default=0)
+    # Each session gets its own question order and image sides, see Session.order_at
+    shuffle = models.BooleanField(default=False,
+                                  help_text='Shuffle question order and image sides per session')
+    questions_per_session = models.IntegerField(
+        null=True, blank=True, help_text='Number of questions in a session, all by default'
+    )
+    allocate = models.BooleanField(
+        default=False, help_text='Serve least answered questions first '
+                                 'and stop asking ones whose answer is already clear'
+    )
 
     def __str__(self):
         return f'{self.title} ({Evaluation.TYPES[self.type]})'
 
+    @property
+    def adaptive(self) -> bool:
+        return self.type in Evaluation.ADAPTIVE_TYPES or self.allocate
+
+    def session_length(self, total: int) -> int:
+        """
+        Number of questions answered in a session out of ``total`` questions
+        """
+        if self.questions_per_session:
+            return min(total, self.questions_per_session)
+        return total
+
+    @staticmethod
+    def bump_version(evaluation_id: int, **fields):
+        Evaluation.objects.filter(id=evaluation_id).update(version=F('version') + 1, **fields)
+
+    def images(self) -> List[FieldFile]:
+        return [
+            image
+            for question in Question.objects.filter(evaluation=self).select_subclasses()
+            for image in question.images()
+        ]
+
+    def image_stats(self) -> Dict[str, dict]:
+        """
+        Count, total size and dimension ranges of question images by format,
+        from values recorded at ingestion
+        """
+        stats = {}
+        for model in [ImageSelectionQuestion, ImageClassificationQuestion]:
+            for field in model.IMAGE_FIELDS:
+                rows = model.objects \
+                    .filter(evaluation=self) \
+                    .values_list(f'{field}_format') \
+                    .annotate(Count('pk'), Sum(f'{field}_size'),
+                              Min(f'{field}_width'), Max(f'{field}_width'),
+                              Min(f'{field}_height'), Max(f'{field}_height'))
+                for format, count, size, min_width, max_width, min_height, max_height in rows:
+                    format_stats = stats.setdefault(format or 'unknown', dict(
+                        count=0, size=0, min_width=None, max_width=None,
+                        min_height=None, max_height=None
+                    ))
+                    format_stats['count'] += count
+                    format_stats['size'] += size or 0
+                    for key, value, pick in [('min_width', min_width, min),
+                                             ('max_width', max_width, max),
+                                             ('min_height', min_height, min),
+                                             ('max_height', max_height, max)]:
+                        if value is not None:
+                            current = format_stats[key]
+                            format_stats[key] = value if current is None else pick(current, value)
+        return stats
+
 
 class Question(models.Model):
     evaluation = models.ForeignKey(Evaluation, on_delete=models.CASCADE)
     text = models.CharField(max_length=1000)
     order = models.IntegerField()
+    # Maintained in allocating evaluations only, see scheduling.record_response
+    responses = models.IntegerField(default=0)
+    retired = models.BooleanField(default=False)
     objects = InheritanceManager()
 
-    def get_real_answer(self, answer):
+    class Meta:
+        indexes = [
+            models.Index(fields=['evaluation', 'retired', 'responses'], name='question_allocation')
+        ]
+
+    def get_real_answer(self, answer, session=None):
         raise NotImplemented()
 
+    def images(self) -> List[FieldFile]:
+        return []
 
+    def image_dimensions(self, image: FieldFile) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Stored (width, height) of question ``image``, (None, None) for images added
+        before dimensions were recorded
+        """
+        name = image.field.name
+        return getattr(self, f'{name}_width'), getattr(self, f'{name}_height')
+
+    @staticmethod
+    @transaction.atomic
+    def bulk_create(questions: Sequence['Question'], batch_size: int = 500,
+                    update_totals: bool = True):
+        """
+        Inserts questions of one subclass with a statement per batch for question table
+        and for subclass table, instead of two per question. Keys are assigned upfront
+        from the largest existing one, the transaction write lock, taken before reading it,
+        keeps them unique.
+
+        Image fields may name files already put to storage, so files are written apart
+        from inserts, or hold unsaved files, which are stored while inserting.
+        Questions without order are appended to their evaluations.
+        Save signals aren't sent, affected evaluations get their version bumped instead
+        and, with ``update_totals``, ``total_questions`` recounted.
+        """
+        if not questions:
+            return
+        model = type(questions[0])
+        if any(type(question) is not model for question in questions):
+            raise ValueError('Questions must be of the same type')
+
+        if connection.vendor == 'sqlite' and not settings.SQLITE_IMMEDIATE_TRANSACTIONS:
+            # Deferred transaction takes the write lock at its first write, which must come
+            # before reading the largest key, or another writer could take the same keys
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {Question._meta.db_table} SET id = id WHERE 0')
+
+        evaluation_ids = sorted({question.evaluation_id for question in questions})
+        next_orders = dict(
+            Question.objects
+                .filter(evaluation_id__in=evaluation_ids)
+                .values_list('evaluation_id')
+                .annotate(Max('order'))
+        )
+        next_id = (Question.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+        for no, question in enumerate(questions):
+            question.id = question.question_ptr_id = next_id + no
+            if question.order is None:
+                last_order = next_orders.get(question.evaluation_id)
+                question.order = next_orders[question.evaluation_id] = \
+                    0 if last_order is None else last_order + 1
+
+        for table in [Question, model]:
+            fields = table._meta.local_concrete_fields
+            for start in range(0, len(questions), batch_size):
+                table._base_manager._insert(questions[start:start + batch_size], fields=fields)
+
+        for question in questions:
+            question._state.adding = False
+            question._state.db = model._base_manager.db
+
+        if not update_totals:
+            for evaluation_id in evaluation_ids:
+                Evaluation.bump_version(evaluation_id)
+            return
+        for evaluation_id, total in Question.objects \
+                .filter(evaluation_id__in=evaluation_ids) \
+                .values_list('evaluation_id') \
+                .annotate(models.Count('id')):
+            Evaluation.bump_version(evaluation_id, total_questions=total)
+
+
+@release_files_on_delete
 class ImageClassificationQuestion(Question):
+    IMAGE_FIELDS = ['image']
+
     image = models.ImageField()
+    # Recorded at ingestion, so files aren't opened to learn them
+    image_width = models.IntegerField(null=True)
+    image_height = models.IntegerField(null=True)
+    image_format = models.CharField(max_length=10, blank=True)
+    image_size = models.IntegerField(null=True)
     answers = models.TextField()
 
     @property
@@ -48,10 +203,18 @@ class ImageClassificationQuestion(Question):
         parsed_answers = json.loads(self.answers)
         return list(zip(range(len(parsed_answers)), parsed_answers))
 
-    def get_real_answer(self, answer):
+    def get_real_answer(self, answer, session=None):
         return answer
 
+    def images(self) -> List[FieldFile]:
+        return [self.image]
+
+
+def random_flip() -> bool:
+    return bool(random.getrandbits(1))
 
+
+@release_files_on_delete
 class ImageSelectionQuestion(Question):
     """
     Example:
@@ -65,163 +228,58 @@ class ImageSelectionQuestion(Question):
         ).save()
 
     """
+    IMAGE_FIELDS = ['left_image', 'right_image']
+
     left_image = models.ImageField()
     right_image = models.ImageField()
-
-    def _neeed_flip(self):
-        hash = int(hashlib.sha1(f"{self.id}".encode()).hexdigest(), 16)
-        return hash % 2 == 0
-
-    def get_left_image(self):
-        if self._neeed_flip():
+    # Methods which produced images in pairwise evaluations
+    left_method = models.ForeignKey('Method', models.CASCADE, null=True, related_name='+')
+    right_method = models.ForeignKey('Method', models.CASCADE, null=True, related_name='+')
+    # Recorded at ingestion, so files aren't opened to learn them
+    left_image_width = models.IntegerField(null=True)
+    left_image_height = models.IntegerField(null=True)
+    left_image_format = models.CharField(max_length=10, blank=True)
+    left_image_size = models.IntegerField(null=True)
+    right_image_width = models.IntegerField(null=True)
+    right_image_height = models.IntegerField(null=True)
+    right_image_format = models.CharField(max_length=10, blank=True)
+    right_image_size = models.IntegerField(null=True)
+    # Whether images are shown swapped, decided once on creation
+    flip = models.BooleanField(default=random_flip)
+
+    def need_flip(self, session=None) -> bool:
+        if session is not None and session.swaps_sides(self.order):
+            return not self.flip
+        return self.flip
+
+    def get_left_image(self, session=None):
+        if self.need_flip(session):
             return self.right_image
         else:
             return self.left_image
 
-    def get_right_image(self):
-        if self._neeed_flip():
+    def get_right_image(self, session=None):
+        if self.need_flip(session):
             return self.left_image
         else:
             return self.right_image
 
-    def get_real_answer(self, answer):
-        if self._neeed_flip():
+    def get_real_answer(self, answer, session=None):
+        if self.need_flip(session):
             return 1 - answer
         return answer
 
+    def images(self) -> List[FieldFile]:
+        return [self.left_image, self.right_image]
 
-class EvaluationForm(ModelForm):
-    images = FileField()
-    question = CharField(max_length=1000)
 
+def bump_evaluation_version(sender, instance: Question, **kwargs):
+    Evaluation.bump_version(instance.evaluation_id)
 
-@admin.register(Evaluation)
-class EvaluationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'title', 'type', 'total_questions', 'created_at']
-    ordering = ['created_at']
-    actions = ['export_result']
-    readonly_fields = ['created_at', 'total_questions']
-    list_editable = ['title']
-    list_display_links = None
-    form = EvaluationForm
 
-    def export_result(self, request, queryset: QuerySet):
-        return redirect('export_result', id=queryset.all()[0].id)
-
-    @transaction.atomic
-    def save_model(self, request, obj, form: ModelForm, change):
-        if change:
-            super().save_model(request, obj, form, True)
-        else:
-            data = form.cleaned_data
-            evaluation: Evaluation = Evaluation(title=data['title'],
-                                                type=data['type'],
-                                                created_at=timezone.now(),
-                                                total_questions=0)
-            evaluation.save()
-
-            if data['type'] == 'SEL':
-                zip_parser = self.make_selection_questions_from_zip
-            else:
-                zip_parser = self.make_classification_questions_from_zip
-
-            evaluation.total_questions = zip_parser(
-                data['images'],
-                data['question'],
-                evaluation
-            )
-
-            evaluation.save()
-
-    @staticmethod
-    def make_selection_questions_from_zip(zip_file_stream, question_text, evaluation):
-        try:
-            with ZipFile(zip_file_stream) as images:
-                baseline_images = EvaluationAdmin.get_fnames_with_prefix(
-                    images, 'baseline/'
-                )
-                proposed_images = EvaluationAdmin.get_fnames_with_prefix(
-                    images, 'proposed/'
-                )
-
-                # Remove all prefixes and exts to match names
-                # proposed/first.jpg -> first
-                baseline_image_names = {
-                    name.rsplit('/', 1)[1].rsplit('.', 1)[0] for name in baseline_images
-                }
-                proposed_image_names = {
-                    name.rsplit('/', 1)[1].rsplit('.', 1)[0] for name in proposed_images
-                }
-
-                if baseline_image_names != proposed_image_names:
-                    raise Exception(
-                        "Proposed and baseline image sets doesn't match"
-                    )
-
-                image_names = baseline_image_names
-
-                total_questions = len(image_names)
-
-                if total_questions == 0:
-                    raise Exception("There must be at least one question")
-
-                questions = []
-                for no, name in enumerate(sorted(image_names)):
-                    # Get image bytes without knowing extension
-                    baseline_bytes = images.read(
-                        EvaluationAdmin.get_fnames_with_prefix(images, f'baseline/{name}')[0]
-                    )
-                    proposed_bytes = images.read(
-                        EvaluationAdmin.get_fnames_with_prefix(images, f'proposed/{name}')[0]
-                    )
-
-                    q = ImageSelectionQuestion(
-                        evaluation=evaluation, text=question_text,
-                        order=no,
-                        left_image=ContentFile(baseline_bytes, f'{evaluation.id}_{no}_l.jpg'),
-                        right_image=ContentFile(proposed_bytes, f'{evaluation.id}_{no}_r.jpg')
-                    )
-                    q.save()
-                    questions.append(q)
-            return total_questions
-        except Exception as e:
-            raise Exception('Zip parsing failed. Most likely the structure is wrong') from e
-
-    @staticmethod
-    def get_fnames_with_prefix(zip: ZipFile, prefix: str) -> List[str]:
-        filenames = [item.filename for item in zip.filelist]
-        return [name for name in filenames if name.startswith(prefix) and len(name) > len(prefix)]
-
-    @staticmethod
-    def make_classification_questions_from_zip(zip_file_stream, question_text, evaluation):
-        try:
-            with ZipFile(zip_file_stream) as images:
-                image_names = EvaluationAdmin.get_fnames_with_prefix(
-                    images, 'images/'
-                )
-
-                with images.open('answers.yml') as yml_stream:
-                    answers = json.dumps(yaml.load(yml_stream))
-
-                total_questions = len(image_names)
-                if total_questions == 0:
-                    raise Exception("There must be at least one question")
-
-                questions = []
-                for no, name in enumerate(image_names):
-                    image_bytes = images.read(name)
-
-                    q = ImageClassificationQuestion(
-                        evaluation=evaluation, text=question_text,
-                        order=no,
-                        answers=answers,
-                        image=ContentFile(image_bytes, f'{evaluation.id}_{no}.jpg'),
-                    )
-                    q.save()
-                    questions.append(q)
-            return total_questions
-        except Exception as e:
-            raise Exception('Zip parsing failed. Most likely the structure is wrong') from e
+for model in [Question, ImageSelectionQuestion, ImageClassificationQuestion]:
+    post_save.connect(bump_evaluation_version, sender=model)
+    post_delete.connect(bump_evaluation_version, sender=model)
 
 
 __all__ = ['Evaluation', 'Question', 'ImageSelectionQuestion', 'ImageClassificationQuestion']
@@ -0,0 +1,202 @@
+from typing import Dict
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Count, Q, Sum
+from django.db.models.signals import pre_delete
+
+from .questions import Evaluation, Question
+from .sessions import Session, Assignment, NO_ANSWER, unpack_answers
+
+
+def increment(model, lookup: dict, **deltas):
+    """
+    Adds ``deltas`` to counter fields of the row matching ``lookup``, creating it when missing
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Created concurrently
+        model.objects.filter(**lookup).update(**updates)
+
+
+class AnswerCounter(models.Model):
+    """
+    Number of times ``answer`` was given to ``question``
+    """
+    question = models.ForeignKey(Question, models.CASCADE)
+    answer = models.IntegerField()
+    # All recorded answers, including ones of sessions still in progress
+    answers = models.IntegerField(default=0)
+    # Answers of completed sessions only, the ones which get into export
+    completed = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('question', 'answer')]
+
+
+class EvaluationCounter(models.Model):
+    evaluation = models.OneToOneField(Evaluation, models.CASCADE, primary_key=True,
+                                      related_name='counter')
+    answers = models.IntegerField(default=0)
+    completed_sessions = models.IntegerField(default=0)
+    # Bumped on every change, so results may be cached by it
+    version = models.IntegerField(default=0)
+
+    @staticmethod
+    def etag(evaluation_id: int) -> str:
+        version = EvaluationCounter.objects \
+            .filter(evaluation_id=evaluation_id) \
+            .values_list('version', flat=True) \
+            .first()
+        return f'{evaluation_id}-{version or 0}'
+
+    @staticmethod
+    def record_answer(assignment: Assignment):
+        increment(AnswerCounter, dict(question_id=assignment.question_id, answer=assignment.answer),
+                  answers=1)
+        increment(EvaluationCounter, dict(evaluation_id=assignment.session.evaluation_id),
+                  answers=1, version=1)
+
+    @staticmethod
+    def record_completion(session: Session):
+        AnswerCounter.objects \
+            .filter(question__assignment__session=session,
+                    question__assignment__answer=F('answer')) \
+            .update(completed=F('completed') + 1)
+        increment(EvaluationCounter, dict(evaluation_id=session.evaluation_id),
+                  completed_sessions=1, version=1)
+
+    @staticmethod
+    def record_deletion(session: Session):
+        """
+        Takes answers of ``session`` about to be deleted out of counters.
+        Must be called in transaction deleting it.
+        """
+        session = Session.objects.get(id=session.id)
+        answers = list(Assignment.objects
+                       .filter(session=session)
+                       .values_list('question_id', 'answer'))
+        if session.packed_answers is not None:
+            question_ids = dict(Question.objects
+                                .filter(evaluation_id=session.evaluation_id)
+                                .values_list('order', 'id'))
+            answers += [
+                (question_ids[order], answer)
+                for order, answer in enumerate(unpack_answers(session.packed_answers))
+                if answer != NO_ANSWER and order in question_ids
+            ]
+
+        completed = int(session.completed)
+        question_ids_by_answer = {}
+        for question_id, answer in answers:
+            question_ids_by_answer.setdefault(answer, []).append(question_id)
+        for answer, question_ids in question_ids_by_answer.items():
+            # SQLite before 3.32 allows 999 query parameters
+            for start in range(0, len(question_ids), 900):
+                AnswerCounter.objects \
+                    .filter(answer=answer, question_id__in=question_ids[start:start + 900]) \
+                    .update(answers=F('answers') - 1, completed=F('completed') - completed)
+        EvaluationCounter.objects \
+            .filter(evaluation_id=session.evaluation_id) \
+            .update(answers=F('answers') - len(answers),
+                    completed_sessions=F('completed_sessions') - completed,
+                    version=F('version') + 1)
+
+    @staticmethod
+    def summary(evaluation: Evaluation) -> dict:
+        """
+        ``{"completed_sessions": n, "questions": {order: {answer: count}}}``
+        over completed sessions, read from counters only
+        """
+        counter = EvaluationCounter.objects.filter(evaluation=evaluation).first()
+        questions: Dict[int, Dict[int, int]] = {
+            order: {} for order in Question.objects
+                .filter(evaluation=evaluation)
+                .order_by('order')
+                .values_list('order', flat=True)
+        }
+        for order, answer, completed in AnswerCounter.objects \
+                .filter(question__evaluation=evaluation, completed__gt=0) \
+                .values_list('question__order', 'answer', 'completed'):
+            questions[order][answer] = completed
+        return {
+            'completed_sessions': counter.completed_sessions if counter else 0,
+            'questions': questions
+        }
+
+    @staticmethod
+    def compute(evaluation: Evaluation):
+        """
+        Counts answers from scratch, both stored as rows and packed
+
+        :return: unsaved evaluation counter and answer counters
+        """
+        answer_counters = {
+            (row['question_id'], row['answer']): AnswerCounter(**row)
+            for row in Assignment.objects
+                .filter(question__evaluation=evaluation)
+                .values('question_id', 'answer')
+                .order_by('question_id', 'answer')
+                .annotate(answers=Count('id'),
+                          completed=Count('id', filter=Q(session__completed_at__isnull=False)))
+        }
+        question_ids = dict(Question.objects
+                            .filter(evaluation=evaluation)
+                            .values_list('order', 'id'))
+        for _, answers in Session.packed(evaluation):
+            for order, answer in enumerate(answers):
+                if answer == NO_ANSWER or order not in question_ids:
+                    continue
+                counter = answer_counters.get((question_ids[order], answer))
+                if counter is None:
+                    counter = answer_counters[question_ids[order], answer] = AnswerCounter(
+                        question_id=question_ids[order], answer=answer, answers=0, completed=0
+                    )
+                # Only completed sessions are packed
+                counter.answers += 1
+                counter.completed += 1
+        answer_counters = [answer_counters[key] for key in sorted(answer_counters)]
+
+        counter = EvaluationCounter(
+            evaluation=evaluation,
+            answers=sum(c.answers for c in answer_counters),
+            completed_sessions=Session.objects
+                .filter(evaluation=evaluation, completed_at__isnull=False)
+                .count()
+        )
+        return counter, answer_counters
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild(evaluation: Evaluation):
+        counter, answer_counters = EvaluationCounter.compute(evaluation)
+        AnswerCounter.objects.filter(question__evaluation=evaluation).delete()
+        AnswerCounter.objects.bulk_create(answer_counters)
+
+        previous = EvaluationCounter.objects.filter(evaluation=evaluation).first()
+        counter.version = previous.version + 1 if previous else 1
+        counter.save()
+
+
+def discount_question_answers(sender, instance: Question, **kwargs):
+    """
+    Takes answers of question about to be deleted out of its evaluation counter,
+    answer counters are deleted with the question
+    """
+    answers = AnswerCounter.objects \
+        .filter(question_id=instance.id) \
+        .aggregate(Sum('answers'))['answers__sum']
+    EvaluationCounter.objects \
+        .filter(evaluation_id=instance.evaluation_id) \
+        .update(answers=F('answers') - (answers or 0), version=F('version') + 1)
+
+
+# Subclass deletion deletes the parent row too, so the signal comes for Question either way
+pre_delete.connect(discount_question_answers, sender=Question)
+
+
+__all__ = ['AnswerCounter', 'EvaluationCounter']
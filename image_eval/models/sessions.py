@@ -1,12 +1,20 @@
 import datetime
+import random
+import sys
+from array import array
 from hashlib import md5
+from math import gcd
+from typing import Dict, Iterator, Tuple
 
+from django.conf import settings
 from django.contrib import admin
-from django.db import models
-from django.db.models import QuerySet
+from django.db import models, transaction
+from django.db.models import QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.shortcuts import redirect
 
 from .questions import Evaluation, Question
+from ..bulk_admin import KeysetAdmin, CompletedListFilter, delete_in_chunks, summarize_deletion
 
 
 class Session(models.Model):
@@ -16,6 +24,23 @@ class Session(models.Model):
     comment = models.CharField(max_length=10_000)
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True)
+    # Number of the completion within evaluation, increasing in commit order, see results feed
+    completion_seq = models.IntegerField(null=True)
+    # Position of the question to show next, equal to its order unless evaluation shuffles
+    next_order = models.IntegerField(default=0)
+    # Determines question order and image sides in shuffling evaluations
+    seed = models.IntegerField(default=0)
+    # Question picked to be shown next in adaptive evaluations
+    pending_question = models.ForeignKey(Question, models.SET_NULL, null=True, related_name='+')
+    # Answers of completed session moved out of Assignment rows, see pack_answers
+    packed_answers = models.BinaryField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['evaluation', 'completed_at'],
+                         name='session_evaluation_completed'),
+            models.Index(fields=['evaluation', 'completion_seq'], name='session_completion_seq'),
+        ]
 
     @staticmethod
     def create_new(evaluation, user_name, comment):
@@ -27,7 +52,8 @@ class Session(models.Model):
             evaluation=evaluation,
             user_name=user_name,
             comment=comment,
-            created_at=created_at
+            created_at=created_at,
+            seed=random.getrandbits(31)
         )
 
     @property
@@ -38,17 +64,220 @@ class Session(models.Model):
         self.completed_at = datetime.datetime.now()
         return self
 
+    def pack(self):
+        """
+        Moves answers of completed session from Assignment rows into ``packed_answers``.
+        Must be called in transaction.
+
+        :raises ValueError: if answered questions share an order, answers are kept by order
+        """
+        assert self.completed and self.packed_answers is None
+        rows = list(Assignment.objects
+                    .filter(session=self)
+                    .values_list('question__order', 'answer'))
+        answers = dict(rows)
+        if len(answers) < len(rows):
+            raise ValueError(f'Questions answered in session {self.id} have duplicate orders')
+        self.packed_answers = pack_answers(answers)
+        self.save(update_fields=['packed_answers'])
+        Assignment.objects.filter(session=self).delete()
+
+    def unpack(self):
+        """
+        Moves answers back from ``packed_answers`` into Assignment rows, which get new ids.
+        Must be called in transaction.
+
+        :raises ValueError: if questions of evaluation share an order
+        """
+        questions = list(Question.objects
+                         .filter(evaluation_id=self.evaluation_id)
+                         .values_list('order', 'id'))
+        question_ids = dict(questions)
+        if len(question_ids) < len(questions):
+            raise ValueError(f'Questions of evaluation {self.evaluation_id} have duplicate orders')
+        Assignment.objects.bulk_create([
+            Assignment(session=self, evaluation_id=self.evaluation_id,
+                       question_id=question_ids[order], answer=answer)
+            for order, answer in enumerate(unpack_answers(self.packed_answers))
+            # Answers to deleted questions are dropped, as their rows would have been
+            if answer != NO_ANSWER and order in question_ids
+        ])
+        self.packed_answers = None
+        self.save(update_fields=['packed_answers'])
+
+    @staticmethod
+    def packed(evaluation: Evaluation, *fields) -> Iterator[tuple]:
+        """
+        ``(id, answers, *fields)`` of sessions of ``evaluation`` with packed answers ordered by id,
+        answers are unpacked. Sessions are read ``EXPORT_CHUNK_SIZE`` at a time.
+        """
+        sessions = Session.objects \
+            .filter(evaluation=evaluation, packed_answers__isnull=False) \
+            .order_by('id') \
+            .values_list('id', 'packed_answers', *fields)
+        after = None
+        while True:
+            chunk = sessions if after is None else sessions.filter(id__gt=after)
+            chunk = list(chunk[:settings.EXPORT_CHUNK_SIZE])
+            for id, data, *values in chunk:
+                yield (id, unpack_answers(data), *values)
+            if len(chunk) < settings.EXPORT_CHUNK_SIZE:
+                return
+            after = chunk[-1][0]
+
+    def save_completion(self) -> bool:
+        """
+        Saves completion time and the next completion number of the evaluation,
+        in one statement so concurrent completions never get the same number
+
+        :return: False if session was completed already, by a concurrent request
+        """
+        last = Session.objects \
+            .filter(evaluation_id=self.evaluation_id, completion_seq__isnull=False) \
+            .order_by('-completion_seq') \
+            .values('completion_seq')[:1]
+        return Session.objects \
+            .filter(id=self.id, completed_at__isnull=True) \
+            .update(completed_at=self.completed_at,
+                    completion_seq=Coalesce(Subquery(last), 0) + 1) > 0
+
+    # Shuffling evaluations show questions in order ``(step * position + offset) % total``,
+    # so nothing has to be stored per session
+
+    def permutation(self, total: int) -> Tuple[int, int]:
+        """
+        :return: (step, offset) of this session question order, step is coprime with total
+        """
+        offset = self.seed % total
+        step = 1 + self.seed // total % total
+        while gcd(step, total) != 1:
+            step += 1
+        return step, offset
+
+    def order_at(self, position: int, total: int) -> int:
+        """
+        Order of the question shown at ``position`` of this session
+        """
+        if not self.evaluation.shuffle:
+            return position
+        step, offset = self.permutation(total)
+        return (step * position + offset) % total
+
+    def position_of(self, order: int, total: int) -> int:
+        if not self.evaluation.shuffle:
+            return order
+        step, offset = self.permutation(total)
+        return (order - offset) * modular_inverse(step, total) % total
+
+    def swaps_sides(self, order: int) -> bool:
+        """
+        Whether this session sees images of selection question swapped
+        relative to ``ImageSelectionQuestion.flip``
+        """
+        if not self.evaluation.shuffle:
+            return False
+        # Top bit of multiplicative hash
+        return bool(((self.seed ^ order) * 0x9E3779B1) & 0x80000000)
+
+
+# Packed answers are 16-bit little-endian integers indexed by question order
+NO_ANSWER = -1
+
+
+def pack_answers(answers: Dict[int, int]) -> bytes:
+    """
+    Packs ``{question order: answer}``, missing orders are ``NO_ANSWER``
+    """
+    packed = array('h', [NO_ANSWER]) * (max(answers, default=-1) + 1)
+    for order, answer in answers.items():
+        packed[order] = answer
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_answers(data: bytes) -> array:
+    """
+    :return: answers indexed by question order, see ``pack_answers``
+    """
+    packed = array('h')
+    packed.frombytes(data)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed
+
+
+def modular_inverse(a: int, n: int) -> int:
+    # Extended Euclid, pow(a, -1, n) needs Python 3.8
+    x, last_x, b, last_b = 0, 1, n, a
+    while b:
+        quotient = last_b // b
+        last_b, b = b, last_b - quotient * b
+        last_x, x = x, last_x - quotient * x
+    return last_x % n
+
 
 class Assignment(models.Model):
     session = models.ForeignKey(Session, models.CASCADE, null=False)
     question = models.ForeignKey(Question, models.CASCADE, null=False)
     answer = models.IntegerField(null=False)
+    # Same as session's, its index is ordered by id within evaluation, which results feed reads
+    evaluation = models.ForeignKey(Evaluation, models.CASCADE, null=False, related_name='+')
+
+    class Meta:
+        unique_together = [('session', 'question')]
 
 
 @admin.register(Session)
-class SessionAdmin(admin.ModelAdmin):
+class SessionAdmin(KeysetAdmin):
     list_display = ['id', 'user_name', 'evaluation', 'comment', 'created_at', 'completed_at']
+    list_filter = ['evaluation', CompletedListFilter]
+    list_select_related = ['evaluation']
+
+    def get_deleted_objects(self, objs, request):
+        return summarize_deletion(objs, self.opts)
+
+    def delete_model(self, request, obj: Session):
+        from .results import EvaluationCounter
+
+        # Session by session, so counters always match answers left
+        # and the database isn't locked for long
+        with transaction.atomic():
+            EvaluationCounter.record_deletion(obj)
+            delete_in_chunks(Assignment.objects.filter(session=obj))
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset: QuerySet):
+        for id in list(queryset.values_list('id', flat=True)):
+            self.delete_model(request, Session.objects.get(id=id))
+
+
+@admin.register(Assignment)
+class AssignmentAdmin(KeysetAdmin):
+    """
+    Read-only browser of answers
+    """
+    list_display = ['id', 'evaluation', 'session_hash', 'user_name', 'question_order', 'answer']
     list_filter = ['evaluation']
-    ordering = ['created_at']
+    list_select_related = ['evaluation', 'session', 'question']
+
+    def session_hash(self, assignment: Assignment):
+        return assignment.session.hash
+
+    def user_name(self, assignment: Assignment):
+        return assignment.session.user_name
+
+    def question_order(self, assignment: Assignment):
+        return assignment.question.order
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 __all__ = ['Session', 'Assignment']
@@ -0,0 +1,147 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import models, transaction, IntegrityError
+from django.db.models.fields.files import FieldFile
+
+from .blobs import release_files_on_delete
+from .. import imaging
+
+logger = logging.getLogger(__name__)
+
+
+@release_files_on_delete
+class ImageVariant(models.Model):
+    """
+    Downscaled and re-encoded copy of a stored image, made at ingestion
+    """
+    # Storage name of the original image
+    source = models.CharField(max_length=100)
+    width = models.IntegerField()
+    format = models.CharField(max_length=10)
+    file = models.ImageField()
+
+    class Meta:
+        unique_together = [('source', 'width', 'format')]
+
+
+class Picture(NamedTuple):
+    """
+    Everything needed to render ``<picture>`` element for a stored image
+    """
+    src: str
+    # Fallback format candidates for <img srcset>
+    srcset: str
+    # (mime type, srcset) for <source> elements, preferred first
+    sources: List[Tuple[str, str]]
+    # (mime type, url) of candidates likely to be picked at typical screen size,
+    # preferred format first, the one usable by any browser last
+    prefetch: List[Tuple[str, str]]
+    # Of the original image, if known, so page layout is reserved before it loads
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    def prefetch_url(self, accept: str) -> str:
+        """
+        Candidate the browser sending ``accept`` header is going to use
+        """
+        for mime, url in self.prefetch[:-1]:
+            if mime in accept:
+                return url
+        return self.prefetch[-1][1]
+
+    @staticmethod
+    def for_images(images: List[FieldFile]) -> List['Picture']:
+        by_source = {}
+        names = [image.name for image in images]
+        # SQLite before 3.32 allows 999 query parameters
+        for start in range(0, len(names), 900):
+            for variant in ImageVariant.objects \
+                    .filter(source__in=names[start:start + 900]) \
+                    .order_by('width'):
+                by_source.setdefault(variant.source, {}) \
+                    .setdefault(variant.format, []) \
+                    .append((variant.file.url, variant.width))
+
+        pictures = []
+        for image in images:
+            variants = by_source.get(image.name, {})
+            modern = [format for format in imaging.MODERN_FORMATS if format in variants]
+            fallback = variants.get('JPEG') or variants.get('PNG') or []
+            pictures.append(Picture(
+                src=image.url,
+                srcset=Picture.format_srcset(fallback),
+                sources=[(imaging.MIME_TYPES[format], Picture.format_srcset(variants[format]))
+                         for format in modern],
+                prefetch=[
+                    (imaging.MIME_TYPES[format],
+                     Picture.closest(variants[format], settings.IMAGE_PREFETCH_WIDTH))
+                    for format in modern
+                ] + [('', Picture.closest(fallback, settings.IMAGE_PREFETCH_WIDTH) or image.url)]
+            ))
+        return pictures
+
+    @staticmethod
+    def format_srcset(candidates: List[Tuple[str, int]]) -> str:
+        return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+    @staticmethod
+    def closest(candidates: List[Tuple[str, int]], width: int) -> Optional[str]:
+        """
+        URL of the narrowest candidate at least ``width`` wide, or the widest one
+        """
+        for url, candidate_width in candidates:
+            if candidate_width >= width:
+                return url
+        return candidates[-1][0] if candidates else None
+
+
+def make_variants(images: Iterable[FieldFile], heartbeat: Callable[[], None] = None):
+    """
+    Renders variants of ``IMAGE_VARIANT_WIDTHS`` widths for images which don't have them yet
+    on a pool of ``IMAGE_VARIANT_WORKERS`` processes.
+    Images which fail to decode are skipped and served as is.
+
+    :param heartbeat: called as each image is done
+    """
+    sources = {image.name: image.path for image in images}
+    done = set(ImageVariant.objects.filter(source__in=sources.keys())
+               .values_list('source', flat=True).distinct())
+    pending = [name for name in sources if name not in done]
+    if not pending:
+        return
+
+    with ProcessPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS) as pool:
+        futures = {
+            name: pool.submit(imaging.render_variants, sources[name],
+                              settings.IMAGE_VARIANT_WIDTHS)
+            for name in pending
+        }
+        for name, future in futures.items():
+            if heartbeat is not None:
+                heartbeat()
+            try:
+                variants = future.result()
+            except Exception:
+                logger.warning('Failed to make variants of %s', name, exc_info=True)
+                continue
+
+            stem = name.rsplit('.', 1)[0]
+            for width, format, data in variants:
+                variant = ImageVariant(
+                    source=name, width=width, format=format,
+                    file=ContentFile(data, f'{stem}_{width}{imaging.EXTENSIONS[format]}')
+                )
+                try:
+                    with transaction.atomic():
+                        variant.save()
+                except IntegrityError:
+                    # Made concurrently by ingestion of another archive with the same image,
+                    # the blob reference is rolled back, the file may be left unreferenced
+                    variant.file.storage.discard(variant.file.name)
+
+
+__all__ = ['ImageVariant', 'Picture']
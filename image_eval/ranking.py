@@ -0,0 +1,83 @@
+"""
+Online Bayesian rating of methods from pairwise comparisons, two-player TrueSkill without draws.
+Skill of each method is a Gaussian (mean, variance), updated after every comparison.
+
+Also confidence of answer shares, deciding when a question needs no more answers.
+"""
+import math
+from typing import List, Tuple
+
+PRIOR_MEAN = 0.0
+PRIOR_VARIANCE = 1.0
+# Variance of a single judgement around the skill difference
+PERFORMANCE_VARIANCE = 0.25
+# Two-sided 95% interval
+CONFIDENCE_Z = 1.96
+
+Rating = Tuple[float, float]
+
+
+def pdf(x: float) -> float:
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def cdf(x: float) -> float:
+    return (1 + math.erf(x / math.sqrt(2))) / 2
+
+
+def update(winner: Rating, loser: Rating) -> Tuple[Rating, Rating]:
+    """
+    :return: (winner, loser) ratings after ``winner`` was preferred to ``loser``
+    """
+    (winner_mean, winner_variance), (loser_mean, loser_variance) = winner, loser
+    c2 = 2 * PERFORMANCE_VARIANCE + winner_variance + loser_variance
+    c = math.sqrt(c2)
+    t = (winner_mean - loser_mean) / c
+    # Guard against underflow when the loser was far stronger
+    v = pdf(t) / max(cdf(t), 1e-12)
+    w = v * (v + t)
+    return (
+        (winner_mean + winner_variance / c * v, winner_variance * (1 - winner_variance / c2 * w)),
+        (loser_mean - loser_variance / c * v, loser_variance * (1 - loser_variance / c2 * w)),
+    )
+
+
+def match_quality(a: Rating, b: Rating) -> float:
+    """
+    Chance of a draw, highest for close and uncertain pairs whose comparison
+    is the most informative
+    """
+    (a_mean, a_variance), (b_mean, b_variance) = a, b
+    c2 = 2 * PERFORMANCE_VARIANCE + a_variance + b_variance
+    return math.sqrt(2 * PERFORMANCE_VARIANCE / c2) * math.exp(-(a_mean - b_mean) ** 2 / (2 * c2))
+
+
+def confidence_interval(rating: Rating) -> Tuple[float, float]:
+    mean, variance = rating
+    half_width = CONFIDENCE_Z * math.sqrt(variance)
+    return mean - half_width, mean + half_width
+
+
+def wilson_interval(successes: int, total: int) -> Tuple[float, float]:
+    """
+    Confidence interval of the share of ``successes`` in ``total`` answers
+    """
+    if total == 0:
+        return 0.0, 1.0
+    z2 = CONFIDENCE_Z ** 2
+    share = successes / total
+    center = (share + z2 / (2 * total)) / (1 + z2 / total)
+    half_width = CONFIDENCE_Z * math.sqrt(share * (1 - share) / total + z2 / (4 * total * total)) \
+        / (1 + z2 / total)
+    return center - half_width, center + half_width
+
+
+def converged(answers: List[int], min_total: int, max_total: int) -> bool:
+    """
+    Whether answers of a question, given as counts per answer, settled on a majority
+    with confidence, or there are already ``max_total`` of them
+    """
+    total = sum(answers)
+    if total >= max_total:
+        return True
+    return total >= min_total and wilson_interval(max(answers), total)[0] > 0.5
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'image_eval.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +54,7 @@ ROOT_URLCONF = 'image_eval.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'image_eval.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -72,10 +73,25 @@ WSGI_APPLICATION = 'image_eval.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+# Seconds a connection waits for the database lock before "database is locked" error
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))
+# Applied to every new connection, WAL lets readers work while someone writes
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable across application crashes, only power loss may lose last commits
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 2 ** 20,
+}
+# Take the write lock when transaction starts, so writers queue instead of failing
+SQLITE_IMMEDIATE_TRANSACTIONS = True
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(VAR, 'db.sqlite3')
+        'ENGINE': 'image_eval.sqlite3',
+        'NAME': os.path.join(VAR, 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+        },
     }
 }
 
@@ -117,4 +133,82 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(VAR, 'media')
+# Deduplicates media by content hash, see image_eval.storage
+DEFAULT_FILE_STORAGE = 'image_eval.storage.ContentAddressedStorage'
+# Serve media through Django, otherwise the web server is expected to do it (see image-eval.ini)
+SERVE_MEDIA = bool(os.environ.get('SERVE_MEDIA', DEBUG))
+# Lifetime of content-addressed media in caches, they never change
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+# Let the web server send media served through Django: None, 'X-Sendfile' or 'X-Accel-Redirect'
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+# Internal location X-Accel-Redirect points to, mapped to MEDIA_ROOT in nginx
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+# Media types stored with gzip sidecars, others are compressed already
+MEDIA_PRECOMPRESS_EXTENSIONS = ['.svg', '.bmp', '.tif', '.tiff']
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+
+# Number of evaluations whose questions are cached in each worker process
+QUESTION_CACHE_SIZE = 32
+
+# Answers each question of allocating evaluation gets before it can be retired
+ALLOCATION_MIN_RESPONSES = 5
+# Answers after which question of allocating evaluation is retired even without clear majority
+ALLOCATION_MAX_RESPONSES = 30
+# Least answered questions one is picked from at random, so concurrent sessions get different ones
+ALLOCATION_CANDIDATES = 20
+
+# Number of next questions whose images are prefetched while answering the current one
+PREFETCH_QUESTIONS = 2
+# Also send prefetch hints in a Link header, for servers and CDNs acting on it
+PREFETCH_LINK_HEADER = bool(os.environ.get('PREFETCH_LINK_HEADER', False))
+
+# Number of questions fetched at once by the survey client mode
+API_BLOCK_SIZE = 20
+# Maximal number of questions or answers in one survey API request
+API_MAX_BLOCK_SIZE = 200
+
+# Number of rows fetched from database at once while streaming results export
+EXPORT_CHUNK_SIZE = 2000
+
+# Resamples of sessions for bootstrap intervals of analysis, see analysis.bootstrap
+ANALYSIS_BOOTSTRAP_RESAMPLES = 1000
+
+# Admin changelists count rows only up to this number
+ADMIN_COUNT_LIMIT = 10_000
+# Rows deleted by one statement when admin deletes sessions or evaluations,
+# below SQLite limit of 999 query parameters
+DELETE_CHUNK_SIZE = 900
+
+# Maximal number of answers and of completed sessions returned by one results feed request
+FEED_PAGE_SIZE = 1000
+
+# Evaluation archives ingestion
+# Number of threads parsing uploaded archives in each worker process
+INGESTION_WORKERS = int(os.environ.get('INGESTION_WORKERS', 1))
+# Number of threads copying images of an archive into media storage
+INGESTION_COPY_WORKERS = int(os.environ.get('INGESTION_COPY_WORKERS', 4))
+# Number of questions committed in one transaction during ingestion
+INGESTION_CHUNK_SIZE = int(os.environ.get('INGESTION_CHUNK_SIZE', 200))
+# Widths of downscaled question images variants served through srcset
+IMAGE_VARIANT_WIDTHS = [480, 960, 1600]
+# Width of the variant preloaded for the next questions
+IMAGE_PREFETCH_WIDTH = 960
+# Number of processes decoding uploaded images and encoding their variants
+IMAGE_VARIANT_WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', 2))
+
+# Per-request metrics, exposed to staff in Prometheus format
+METRICS_ENABLED = bool(os.environ.get('METRICS_ENABLED', True))
+# Directory where each worker process dumps its histograms
+METRICS_DIR = os.path.join(VAR, 'metrics')
+# Seconds between dumps of worker histograms
+METRICS_FLUSH_INTERVAL = 10
+# Requests slower than that are logged with their SQL, disabled when unset
+METRICS_SLOW_REQUEST_SECONDS = float(os.environ['METRICS_SLOW_REQUEST_SECONDS']) \
+    if os.environ.get('METRICS_SLOW_REQUEST_SECONDS') else None
+
+# Seconds answers of concurrent requests in one worker are collected to be written
+# in one transaction, writes aren't coalesced when 0. Only useful with several
+# request threads per worker process.
+ANSWER_COALESCE_WINDOW = float(os.environ.get('ANSWER_COALESCE_WINDOW', 0))
+# Maximal number of requests whose answers are written in one transaction
+ANSWER_COALESCE_MAX_BATCH = 50
@@ -0,0 +1,22 @@
+"""
+SQLite backend tuned for several worker processes writing to one database file
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # Deferred transaction upgrading its read lock to write one fails at once
+        # with "database is locked" instead of waiting for the busy timeout,
+        # so take the write lock at the start
+        if settings.SQLITE_IMMEDIATE_TRANSACTIONS:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import os
+import re
+from tempfile import NamedTemporaryFile
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+from .models import Blob, ImageVariant
+
+CONTENT_NAME = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{62})\.\w+$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Names files by SHA-256 of their content: ``ab/cdef...0123.jpg``.
+    Saving bytes which are already stored doesn't write anything,
+    the existing blob just gets one more reference.
+    Deleting a file drops a reference, the file itself is removed
+    when no references are left.
+
+    Files without a tracked ``Blob`` (saved before the storage was introduced)
+    are deleted right away.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Final name is known only after content is hashed, see _save
+        return name
+
+    def _save(self, name, content):
+        name, size = self.write_content(name, content)
+        Blob.acquire(name, size)
+        if not self.exists(name):
+            # Unlinked by deletion of its last other reference in the meantime,
+            # the reference held now keeps it from being unlinked again
+            content.seek(0)
+            self.write_content(name, content)
+        return name
+
+    def write_content(self, name, content) -> Tuple[str, int]:
+        """
+        Writes file like ``save`` does, but without acquiring its ``Blob``, which the caller
+        has to do. Doesn't touch the database, so may run in threads next to a transaction.
+
+        :return: (content name, size)
+        """
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with NamedTemporaryFile(dir=self.location, prefix='.staged-', delete=False) as staged:
+            try:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    staged.write(chunk)
+            except BaseException:
+                os.remove(staged.name)
+                raise
+
+        name = self.content_name(digest.hexdigest(), name)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            os.remove(staged.name)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            # Concurrent writers of the same blob write the same bytes,
+            # so replacing is harmless
+            os.replace(staged.name, full_path)
+            os.chmod(full_path, self.file_permissions_mode or 0o644)
+            self.precompress(full_path)
+        return name, size
+
+    @staticmethod
+    def content_name(digest: str, name: str) -> str:
+        ext = os.path.splitext(name)[1].lower()
+        return f'{digest[:2]}/{digest[2:]}{ext}'
+
+    @staticmethod
+    def content_digest(name: str) -> Optional[str]:
+        """
+        :return: SHA-256 of content for names given by this storage, None for others
+        """
+        match = CONTENT_NAME.match(name)
+        return match.group(1) + match.group(2) if match else None
+
+    def precompress(self, full_path: str):
+        """
+        Writes ``.gz`` sidecar next to files of ``MEDIA_PRECOMPRESS_EXTENSIONS`` types
+        if it is noticeably smaller, so web servers may send it as is
+        """
+        if os.path.splitext(full_path)[1] not in settings.MEDIA_PRECOMPRESS_EXTENSIONS:
+            return
+        with open(full_path, 'rb') as source:
+            compressed = gzip.compress(source.read(), 9)
+        if len(compressed) < os.path.getsize(full_path) * 0.9:
+            with open(full_path + '.gz', 'wb') as sidecar:
+                sidecar.write(compressed)
+            os.chmod(full_path + '.gz', self.file_permissions_mode or 0o644)
+
+    def delete(self, name):
+        if Blob.release(name):
+            # Unlink only after the new reference count is visible to others
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def discard(self, name):
+        """
+        Removes file written by a save which was rolled back, unless it is referenced
+        """
+        transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        # Checked and unlinked under the write lock, so a transaction acquiring the blob
+        # either commits before the check or finds the file gone after acquiring it
+        with transaction.atomic():
+            Blob.lock()
+            if not Blob.objects.filter(name=name).exists():
+                super().delete(name)
+                super().delete(name + '.gz')
+                # Variants release their own blobs
+                ImageVariant.objects.filter(source=name).delete()
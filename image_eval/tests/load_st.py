@@ -5,7 +5,7 @@ from hashlib import md5
 
 from django.core.files.base import ContentFile
 
-from ..models import Evaluation, ImageSelectionQuestion, ImageClassificationQuestion
+from ..models import Evaluation, Question, ImageSelectionQuestion, ImageClassificationQuestion
 
 
 def load():
@@ -22,6 +22,7 @@ def load():
     e.save()
 
     info = {}
+    questions = []
 
     for no, p in enumerate(image_prefixes):
         edges = (images / f'{p}_edges.jpg').read_bytes()
@@ -33,13 +34,15 @@ def load():
 
         info[p] = model_id
 
-        ImageSelectionQuestion(
+        questions.append(ImageSelectionQuestion(
             evaluation=e,
             text='Select image you like more:',
             left_image=ContentFile(models[model_id], f'{p}_0.jpg'),
             right_image=ContentFile(models[1 - model_id], f'{p}_1.jpg'),
             order=no
-        ).save()
+        ))
+
+    Question.bulk_create(questions)
 
     json.dump(info, open('site-eval-info.json', 'w'))
 
@@ -48,16 +51,16 @@ def load():
     e.save()
     answers = json.dumps([str(i) for i in range(1, 6)])
 
-    for no, p in enumerate(image_prefixes):
-        edges = (images / f'{p}_edges.jpg').read_bytes()
-
+    Question.bulk_create([
         ImageClassificationQuestion(
             evaluation=e,
             text='Rate image',
-            image=ContentFile(edges, f'{p}_0.jpg'),
+            image=ContentFile((images / f'{p}_edges.jpg').read_bytes(), f'{p}_0.jpg'),
             answers=answers,
             order=no
-        ).save()
+        )
+        for no, p in enumerate(image_prefixes)
+    ])
 
 
 
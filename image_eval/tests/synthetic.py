@@ -0,0 +1,81 @@
+import random
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED
+
+import yaml
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image
+
+from ..models import Evaluation, Question, ImageSelectionQuestion
+
+
+def make_image(width: int, height: int, format: str = 'JPEG', seed: int = 0) -> bytes:
+    """
+    Noisy image, so encoders can't shrink it to nothing
+    """
+    rng = random.Random(seed)
+    noise_size = (max(1, width // 8), max(1, height // 8))
+    noise = bytes(rng.getrandbits(8) for _ in range(3 * noise_size[0] * noise_size[1]))
+    image = Image.frombytes('RGB', noise_size, noise).resize((width, height), Image.BILINEAR)
+    stream = BytesIO()
+    image.save(stream, format)
+    return stream.getvalue()
+
+
+def make_selection_evaluation(questions: int, distinct_images: int = 8,
+                              size=(320, 240), title='Synthetic') -> Evaluation:
+    """
+    Selection evaluation whose questions reuse ``distinct_images`` images
+    """
+    images = [make_image(*size, seed=seed) for seed in range(distinct_images)]
+
+    e = Evaluation(title=title, created_at=timezone.now(), type='SEL',
+                   total_questions=questions)
+    e.save()
+    Question.bulk_create([
+        ImageSelectionQuestion(
+            evaluation=e,
+            text='Select image you like more:',
+            order=no,
+            left_image=ContentFile(images[no % distinct_images], f'{no}_l.jpg'),
+            right_image=ContentFile(images[(no + 1) % distinct_images], f'{no}_r.jpg')
+        )
+        for no in range(questions)
+    ])
+    return e
+
+
+def make_archive_image(no: int, size, png_ratio: float, seed: int):
+    """
+    :return: (extension, image data) of the ``no``-th distinct archive image,
+        PNG with ``png_ratio`` probability
+    """
+    rng = random.Random(seed * 1_000_003 + no)
+    format = 'PNG' if rng.random() < png_ratio else 'JPEG'
+    extension = 'png' if format == 'PNG' else 'jpg'
+    return extension, make_image(*size, format=format, seed=rng.getrandbits(32))
+
+
+def write_selection_archive(stream, count: int, size=(320, 240), png_ratio: float = 0.0,
+                            seed: int = 0):
+    """
+    Writes archive of ``count`` baseline/proposed pairs with distinct images
+    """
+    with ZipFile(stream, 'w', ZIP_STORED) as archive:
+        for no in range(count):
+            for folder, image_no in [('baseline', 2 * no), ('proposed', 2 * no + 1)]:
+                extension, data = make_archive_image(image_no, size, png_ratio, seed)
+                archive.writestr(f'{folder}/{no:06}.{extension}', data)
+
+
+def write_classification_archive(stream, count: int, size=(320, 240), png_ratio: float = 0.0,
+                                 seed: int = 0, choices=('Cat', 'Dog', 'Other')):
+    """
+    Writes archive of ``count`` distinct images with answers.yml
+    """
+    with ZipFile(stream, 'w', ZIP_STORED) as archive:
+        archive.writestr('answers.yml', yaml.safe_dump(list(choices)))
+        for no in range(count):
+            extension, data = make_archive_image(no, size, png_ratio, seed)
+            archive.writestr(f'images/{no:06}.{extension}', data)
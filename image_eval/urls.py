@@ -13,9 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 
 from image_eval import settings
 from . import views
@@ -24,6 +23,20 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('sessions/new', views.new_session, name='new_session'),
     path('sessions/<str:hash>/', views.session_view, name='session'),
+    path('sessions/<str:hash>/questions.json', views.session_questions, name='session_questions'),
+    path('sessions/<str:hash>/answers.json', views.session_answers, name='session_answers'),
     path('evaluations/<int:id>/results.json', views.export_results, name='export_result'),
+    path('evaluations/<int:id>/results.csv', views.export_results, dict(format='csv'),
+         name='export_result_csv'),
+    path('evaluations/<int:id>/summary.json', views.export_summary, name='export_summary'),
+    path('evaluations/<int:id>/analysis.npz', views.export_analysis, name='export_analysis'),
+    path('evaluations/<int:id>/feed.json', views.export_feed, name='export_feed'),
+    path('evaluations/<int:id>/rankings.json', views.export_rankings, name='export_rankings'),
+    path('metrics', views.export_metrics, name='metrics'),
     path('admin/', admin.site.urls)
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+if settings.SERVE_MEDIA:
+    urlpatterns.append(
+        re_path(r'^{}(?P<path>.*)$'.format(settings.MEDIA_URL.lstrip('/')), views.serve_media)
+    )
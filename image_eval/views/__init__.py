@@ -1,2 +1,5 @@
 from .home import *
 from .session import *
+from .api import *
+from .media import *
+from .metrics import *
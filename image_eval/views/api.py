@@ -0,0 +1,108 @@
+import json
+
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET, require_POST
+
+from .cache import CachedQuestion, get_cached_evaluation
+from .scheduling import current_question
+from .session import record_answer, complete_if_finished
+from ..models import Session
+from ..writer import write_answers
+
+
+def question_json(question: CachedQuestion) -> dict:
+    return dict(
+        id=question.id,
+        order=question.order,
+        position=question.position,
+        text=question.text,
+        choices=None if question.choices is None else [name for _, name in question.choices],
+        images=[
+            dict(
+                src=picture.src,
+                srcset=picture.srcset,
+                width=picture.width,
+                height=picture.height,
+                sources=[dict(type=type, srcset=srcset) for type, srcset in picture.sources]
+            )
+            for picture in question.pictures
+        ]
+    )
+
+
+def progress_json(session: Session, total: int, **extra) -> dict:
+    return dict(
+        total=total,
+        next_order=session.next_order,
+        completed=session.completed,
+        **extra
+    )
+
+
+@require_GET
+def session_questions(request: HttpRequest, hash: str):
+    """
+    Returns block of ``count`` questions starting from ``from`` position
+    or the next unanswered question. Adaptive evaluations return just the next question.
+    """
+    session = get_object_or_404(Session.objects.select_related('evaluation'), hash=hash)
+    cached = get_cached_evaluation(session.evaluation)
+    total = session.evaluation.session_length(len(cached.questions))
+
+    try:
+        count = min(int(request.GET.get('count', settings.API_BLOCK_SIZE)),
+                    settings.API_MAX_BLOCK_SIZE)
+        start = max(int(request.GET.get('from', 0)), session.next_order)
+    except ValueError:
+        return JsonResponse({'error': 'count and from must be integers'}, status=400)
+
+    if session.completed:
+        block = []
+    elif session.evaluation.adaptive:
+        block = [question for question in [current_question(session, cached)] if question]
+    else:
+        block = [cached.question_at(session, position)
+                 for position in range(start, min(start + count, total))]
+    return JsonResponse(progress_json(
+        session, total,
+        questions=[question_json(question) for question in block]
+    ))
+
+
+@require_POST
+def session_answers(request: HttpRequest, hash: str):
+    """
+    Records ``{"answers": [{"question_id": 1, "answer": 0}, ...]}`` in one transaction.
+    Answers are given as shown to participant, like ones posted to ``session_view``.
+    Already answered questions are skipped, so a failed batch may be resent as is.
+    """
+    session = get_object_or_404(Session.objects.select_related('evaluation'), hash=hash)
+    cached = get_cached_evaluation(session.evaluation)
+
+    try:
+        raw_answers = json.loads(request.body.decode())['answers']
+        if len(raw_answers) > settings.API_MAX_BLOCK_SIZE:
+            return JsonResponse({'error': 'Too many answers'}, status=400)
+        answers = [(cached.seen_by(session, cached.by_id[int(a['question_id'])]), int(a['answer']))
+                   for a in raw_answers]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Malformed answers'}, status=400)
+
+    for question, answer in answers:
+        if not question.accepts(answer):
+            return JsonResponse({'error': f'Wrong answer to question {question.id}'}, status=400)
+
+    def work():
+        recorded = sum(record_answer(session, question, answer) for question, answer in answers)
+        complete_if_finished(session, cached.questions)
+        return recorded
+
+    recorded = 0 if session.completed else write_answers(work)
+
+    total = session.evaluation.session_length(len(cached.questions))
+    return JsonResponse(progress_json(session, total, recorded=recorded))
+
+
+__all__ = ['session_questions', 'session_answers']
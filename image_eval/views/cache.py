@@ -0,0 +1,152 @@
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from ..models import Evaluation, Question, ImageSelectionQuestion, ImageClassificationQuestion, \
+    Picture, Session
+
+
+class CachedQuestion(NamedTuple):
+    """
+    Everything needed to render and answer a question without touching the database
+    """
+    id: int
+    order: int
+    # Position in the session question sequence, see CachedEvaluation.seen_by
+    position: int
+    text: str
+    template: str
+    pictures: List[Picture]
+    # Whether selection images are shown swapped, see ImageSelectionQuestion.need_flip
+    flip: bool
+    # (value, name) pairs of classification answers
+    choices: Optional[list]
+    # (left, right) method ids of pairwise comparison, sides as stored, not as shown
+    methods: Optional[Tuple[int, int]]
+
+    def get_real_answer(self, answer):
+        if self.flip:
+            return 1 - answer
+        return answer
+
+    def accepts(self, answer: int) -> bool:
+        variants = 2 if self.choices is None else len(self.choices)
+        return 0 <= answer < variants
+
+
+class CachedEvaluation(NamedTuple):
+    version: int
+    # Ordered by question order
+    questions: List[CachedQuestion]
+    by_id: Dict[int, CachedQuestion]
+    # Questions of pairwise evaluation by their (left, right) methods
+    by_pair: Dict[Tuple[int, int], List[CachedQuestion]]
+
+    def question_at(self, session: Session, position: int) -> CachedQuestion:
+        """
+        Question shown at ``position`` of ``session``
+        """
+        order = session.order_at(position, len(self.questions))
+        return self.seen_by(session, self.questions[order])
+
+    def seen_by(self, session: Session, question: CachedQuestion) -> CachedQuestion:
+        """
+        Question as it's shown to participant of ``session``
+        """
+        if session.evaluation.adaptive:
+            # Picked one at a time, see scheduling.current_question
+            return question._replace(position=session.next_order)
+        if not session.evaluation.shuffle:
+            return question
+        position = session.position_of(question.order, len(self.questions))
+        if question.choices is None and session.swaps_sides(question.order):
+            return question._replace(position=position, flip=not question.flip,
+                                     pictures=question.pictures[::-1])
+        return question._replace(position=position)
+
+
+_cache: 'OrderedDict[int, CachedEvaluation]' = OrderedDict()
+_lock = Lock()
+
+
+def get_cached_evaluation(evaluation: Evaluation) -> CachedEvaluation:
+    """
+    Returns questions of evaluation from the per-process LRU cache
+    of ``QUESTION_CACHE_SIZE`` evaluations, loading them if ``evaluation.version`` changed
+    """
+    with _lock:
+        cached = _cache.get(evaluation.id)
+        if cached is not None and cached.version == evaluation.version:
+            _cache.move_to_end(evaluation.id)
+            return cached
+
+    cached = load_evaluation(evaluation)
+
+    with _lock:
+        _cache[evaluation.id] = cached
+        _cache.move_to_end(evaluation.id)
+        while len(_cache) > settings.QUESTION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return cached
+
+
+def load_evaluation(evaluation: Evaluation) -> CachedEvaluation:
+    questions = list(Question.objects
+                     .filter(evaluation=evaluation)
+                     .order_by('order')
+                     .select_subclasses())
+    pictures = iter(Picture.for_images([
+        image for question in questions for image in question_images(question)
+    ]))
+
+    cached_questions = []
+    for question in questions:
+        common = dict(
+            id=question.id,
+            order=question.order,
+            position=question.order,
+            text=question.text,
+            pictures=[
+                next(pictures)._replace(width=width, height=height)
+                for width, height in map(question.image_dimensions, question_images(question))
+            ],
+        )
+        if isinstance(question, ImageSelectionQuestion):
+            methods = None
+            if question.left_method_id is not None:
+                methods = (question.left_method_id, question.right_method_id)
+            cached_questions.append(CachedQuestion(
+                template='selection_question.html', flip=question.flip, choices=None,
+                methods=methods, **common
+            ))
+        elif isinstance(question, ImageClassificationQuestion):
+            cached_questions.append(CachedQuestion(
+                template='classification_question.html', flip=False, choices=question.choices,
+                methods=None, **common
+            ))
+        else:
+            raise NotImplemented
+
+    by_pair = {}
+    for question in cached_questions:
+        if question.methods is not None:
+            by_pair.setdefault(question.methods, []).append(question)
+
+    return CachedEvaluation(
+        version=evaluation.version,
+        questions=cached_questions,
+        by_id={question.id: question for question in cached_questions},
+        by_pair=by_pair
+    )
+
+
+def question_images(question: Question):
+    """
+    Images in the order they are shown
+    """
+    if isinstance(question, ImageSelectionQuestion):
+        return [question.get_left_image(), question.get_right_image()]
+    return question.images()
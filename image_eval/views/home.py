@@ -5,7 +5,8 @@ from image_eval.models import Evaluation
 
 
 def home(request: HttpRequest, error=False):
-    evaluations = Evaluation.objects.all()
+    # Evaluations still being ingested have no questions yet
+    evaluations = Evaluation.objects.filter(total_questions__gt=0)
 
     eval_info = {e.id: f'{e.title} ({Evaluation.TYPES[e.type]})' for e in evaluations}
     
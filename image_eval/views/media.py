@@ -0,0 +1,65 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.static import serve
+
+from .. import imaging
+from ..storage import ContentAddressedStorage
+
+CONTENT_TYPES = {ext: imaging.MIME_TYPES[format] for format, ext in imaging.EXTENSIONS.items()}
+
+
+def serve_media(request: HttpRequest, path: str):
+    """
+    Serves uploaded media. Content-addressed files never change, so they are sent
+    with a strong ETag and cached forever, gzip sidecars are used if present
+    and have an ETag of their own.
+    With ``MEDIA_SENDFILE`` set the file itself is sent by the web server.
+    Other files are served by ``django.views.static.serve``.
+    """
+    digest = ContentAddressedStorage.content_digest(path)
+    if digest is None:
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    if not os.path.isfile(full_path):
+        raise Http404(f'"{path}" does not exist')
+
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1]) or \
+        mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    etag = f'"{digest}"'
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '') and \
+            os.path.isfile(full_path + '.gz'):
+        path += '.gz'
+        full_path += '.gz'
+        encoding = 'gzip'
+        # Compressed bytes differ, so they are a different representation for caches
+        etag = f'"{digest}-gzip"'
+
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        if settings.MEDIA_SENDFILE == 'X-Accel-Redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path
+        elif settings.MEDIA_SENDFILE == 'X-Sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            response['Content-Length'] = os.path.getsize(full_path)
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.MEDIA_MAX_AGE, immutable=True)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+__all__ = ['serve_media']
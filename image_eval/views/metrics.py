@@ -0,0 +1,16 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpRequest, HttpResponse
+
+from ..metrics import registry
+
+
+@staff_member_required
+def export_metrics(request: HttpRequest):
+    """
+    Per-view request histograms of all worker processes in Prometheus text format
+    """
+    return HttpResponse(registry.format_prometheus(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+__all__ = ['export_metrics']
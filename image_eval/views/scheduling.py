@@ -0,0 +1,122 @@
+import random
+from collections import Counter
+from typing import Optional
+
+from django.conf import settings
+
+from .cache import CachedEvaluation, CachedQuestion
+from .. import ranking
+from ..models import Session, Assignment, Method, Question, AnswerCounter
+
+
+def current_question(session: Session, cached: CachedEvaluation) -> Optional[CachedQuestion]:
+    """
+    Question to show next as ``session`` sees it, None once nothing is left to ask.
+    Adaptive evaluations pick it from answers given so far and keep it
+    in ``session.pending_question`` until it's answered, so reloads show the same one.
+    """
+    if session.next_order >= session.evaluation.session_length(len(cached.questions)):
+        return None
+    if not session.evaluation.adaptive:
+        return cached.question_at(session, session.next_order)
+
+    question = cached.by_id.get(session.pending_question_id)
+    if question is None:
+        question = pick_question(session, cached)
+        if question is None:
+            return None
+        # Concurrent request of the same session may have picked one already, first one wins
+        if Session.objects \
+                .filter(id=session.id, pending_question=session.pending_question_id) \
+                .update(pending_question=question.id):
+            session.pending_question_id = question.id
+        else:
+            session.pending_question_id = Session.objects \
+                .filter(id=session.id) \
+                .values_list('pending_question', flat=True) \
+                .get()
+            question = cached.by_id.get(session.pending_question_id)
+            if question is None:
+                return None
+    return cached.seen_by(session, question)
+
+
+def pick_question(session: Session, cached: CachedEvaluation) -> Optional[CachedQuestion]:
+    if session.evaluation.allocate:
+        return pick_allocated_question(session, cached)
+    return PICKERS[session.evaluation.type](session, cached)
+
+
+def answered_questions(session: Session):
+    return set(Assignment.objects.filter(session=session).values_list('question_id', flat=True))
+
+
+def pick_pair_question(session: Session, cached: CachedEvaluation) -> Optional[CachedQuestion]:
+    """
+    Picks pair of methods with probability proportional to how informative their
+    comparison is for the current ratings, then a random image the session
+    hasn't compared them on yet
+    """
+    ratings = {
+        id: (mean, variance)
+        for id, mean, variance in Method.objects
+            .filter(evaluation_id=session.evaluation_id)
+            .values_list('id', 'mean', 'variance')
+    }
+    answered = answered_questions(session)
+    answered_by_pair = Counter(
+        cached.by_id[id].methods for id in answered if id in cached.by_id
+    )
+    pairs = [
+        pair for pair, questions in cached.by_pair.items()
+        if answered_by_pair[pair] < len(questions)
+    ]
+    if not pairs:
+        return None
+
+    weights = [ranking.match_quality(ratings[left], ratings[right]) for left, right in pairs]
+    pair = random.choices(pairs, weights)[0]
+    return random.choice([
+        question for question in cached.by_pair[pair] if question.id not in answered
+    ])
+
+
+def pick_allocated_question(session: Session, cached: CachedEvaluation) -> Optional[CachedQuestion]:
+    """
+    Picks one of the least answered questions that aren't retired and the session
+    hasn't answered yet. Walks the allocation index in answer count order,
+    so only a few rows are read regardless of evaluation size.
+    """
+    candidates = list(
+        Question.objects
+            .filter(evaluation_id=session.evaluation_id, retired=False)
+            .exclude(id__in=Assignment.objects.filter(session=session).values('question_id'))
+            .order_by('responses')
+            .values_list('id', 'responses')[:settings.ALLOCATION_CANDIDATES]
+    )
+    least = [id for id, responses in candidates
+             if responses == candidates[0][1] and id in cached.by_id]
+    if not least:
+        return None
+    return cached.by_id[random.choice(least)]
+
+
+def record_response(question: CachedQuestion):
+    """
+    Updates answer count of question of allocating evaluation after an answer to it
+    was counted and retires the question once its answers converged
+    """
+    answers = list(AnswerCounter.objects
+                   .filter(question_id=question.id)
+                   .values_list('answers', flat=True))
+    Question.objects.filter(id=question.id).update(
+        responses=sum(answers),
+        retired=ranking.converged(answers, settings.ALLOCATION_MIN_RESPONSES,
+                                  settings.ALLOCATION_MAX_RESPONSES)
+    )
+
+
+# Evaluation type -> function picking the next question of adaptive evaluation
+PICKERS = {
+    'PAIR': pick_pair_question,
+}
@@ -1,71 +1,144 @@
+import csv
+import heapq
 import json
+from itertools import groupby
+from operator import itemgetter
+from typing import List
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import QuerySet, Max
-from django.http import HttpRequest, HttpResponse
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
 
+from .cache import CachedQuestion, CachedEvaluation, get_cached_evaluation
 from .home import home
-from ..models import Question, Evaluation, Session, Assignment
+from .scheduling import current_question, record_response
+from .. import analysis
+from ..models import Question, Evaluation, Session, Assignment, EvaluationCounter, Method
+from ..models.sessions import NO_ANSWER
+from ..writer import write_answers
 
 
-def render_question(request, session, question_no, error=False):
-    current_question = Question.objects.get(evaluation=session.evaluation, order=question_no)
+def render_question(request, session, question: CachedQuestion, cached: CachedEvaluation,
+                    error=False):
+    # Images of the following questions, as they'll be shown, for the browser to fetch ahead.
+    # Adaptive evaluations don't know them until this one is answered.
+    accept = request.META.get('HTTP_ACCEPT', '')
+    total = session.evaluation.session_length(len(cached.questions))
+    following = [] if session.evaluation.adaptive else range(
+        question.position + 1, min(question.position + 1 + settings.PREFETCH_QUESTIONS, total)
+    )
+    prefetch = [
+        picture.prefetch_url(accept)
+        for position in following
+        for picture in cached.question_at(session, position).pictures
+    ]
 
-    if hasattr(current_question, 'imageselectionquestion'):
-
-        return render(request, 'selection_question.html', dict(
-            question=current_question.imageselectionquestion,
-            evaluation=session.evaluation,
-            error=error
-        ))
-    elif hasattr(current_question, 'imageclassificationquestion'):
-        return render(request, 'classification_question.html', dict(
-            question=current_question.imageclassificationquestion,
-            evaluation=session.evaluation,
-            error=error
-        ))
-    else:
-        raise NotImplemented
+    response = render(request, question.template, dict(
+        question=question,
+        pictures=question.pictures,
+        prefetch=prefetch,
+        evaluation=session.evaluation,
+        total=total,
+        error=error
+    ))
+    if settings.PREFETCH_LINK_HEADER and prefetch:
+        response['Link'] = ', '.join(f'<{url}>; rel=prefetch; as=image' for url in prefetch)
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 def session_view(request: HttpRequest, hash: str):
-    session = Session.objects.get(hash=hash)
+    session = Session.objects.select_related('evaluation').get(hash=hash)
+    cached = get_cached_evaluation(session.evaluation)
+    questions = cached.questions
 
     if not session.completed:
         if request.method == 'POST':
-            question = Question.objects.get_subclass(id=int(request.POST['question_id']))
+            question = cached.seen_by(session, cached.by_id[int(request.POST['question_id'])])
 
             if 'answer' not in request.POST:
-                return render_question(request, session, question.order, True)
+                return render_question(request, session, question, cached, True)
 
-            raw_answer = request.POST['answer']
-            answer = question.get_real_answer(int(raw_answer))
+            answer = int(request.POST['answer'])
 
-            next_order = question.order + 1
+            def work():
+                record_answer(session, question, answer)
+                complete_if_finished(session, questions)
 
-            ass = Assignment(question=question, session=session, answer=answer)
-            ass.save()
+            write_answers(work)
         else:
-            done_questions: QuerySet = Assignment.objects.filter(session=session)
-
-            if done_questions.exists():
-                query_res = done_questions.aggregate(Max('question__order'))
-                next_order = query_res['question__order__max']
-            else:
-                next_order = 0
+            complete_if_finished(session, questions)
 
-        max_question_no = Question.objects \
-            .filter(evaluation=session.evaluation) \
-            .aggregate(Max('order'))['order__max']
-
-        if max_question_no < next_order:
-            session.complete().save()
+    question = None if session.completed else current_question(session, cached)
+    if question is None and not session.completed:
+        # Adaptive evaluation has nothing left worth asking
+        complete_session(session)
 
+    # Client mode fetches questions ahead, which adaptive evaluations can't tell
+    client = request.GET.get('client') and not session.evaluation.adaptive
     if session.completed:
+        if client:
+            return redirect('session', hash=session.hash)
         return render(request, 'session_completed.html')
 
-    return render_question(request, session, next_order)
+    if client:
+        return render(request, 'survey_client.html', dict(
+            session=session,
+            evaluation=session.evaluation,
+            total=session.evaluation.session_length(len(questions)),
+            block_size=settings.API_BLOCK_SIZE
+        ))
+
+    return render_question(request, session, question, cached)
+
+
+def record_answer(session: Session, question: CachedQuestion, raw_answer: int) -> bool:
+    """
+    Saves answer to ``question`` as shown to participant (see ``CachedEvaluation.seen_by``)
+    and advances session cursor. Must be called in transaction.
+
+    :return: False if the question was already answered or, in adaptive evaluation,
+        isn't the one picked for the session, nothing is changed then
+    """
+    if session.evaluation.adaptive and question.id != session.pending_question_id:
+        return False
+
+    answer = question.get_real_answer(raw_answer)
+    ass, created = Assignment.objects.get_or_create(
+        session=session, question_id=question.id,
+        defaults=dict(answer=answer, evaluation_id=session.evaluation_id)
+    )
+    # Repeated submits of the same question change nothing
+    if created:
+        EvaluationCounter.record_answer(ass)
+        if question.methods is not None:
+            left, right = question.methods
+            Method.record_comparison(*((left, right) if answer == 0 else (right, left)))
+        if session.evaluation.allocate:
+            record_response(question)
+        if session.next_order <= question.position:
+            session.next_order = question.position + 1
+            session.pending_question_id = None
+            Session.objects \
+                .filter(id=session.id, next_order__lte=question.position) \
+                .update(next_order=session.next_order, pending_question=None)
+    return created
+
+
+def complete_if_finished(session: Session, questions: List[CachedQuestion]):
+    if session.evaluation.session_length(len(questions)) <= session.next_order:
+        complete_session(session)
+
+
+def complete_session(session: Session):
+    with transaction.atomic():
+        # Counted once, however many requests find the session finished
+        if session.complete().save_completion():
+            EvaluationCounter.record_completion(session)
 
 
 def new_session(request: HttpRequest):
@@ -83,19 +156,188 @@ def new_session(request: HttpRequest):
     return redirect('session', hash=session.hash, permanent=True)
 
 
+def iter_completed_answers(evaluation: Evaluation, *fields):
+    """
+    Streams answers of completed sessions ordered by question order and session,
+    merging answers stored as rows, read with a single query, with packed ones.
+    ``fields`` are ``'answer'`` and fields of session prefixed with ``session__``.
+    """
+    rows = Assignment.objects \
+        .filter(session__evaluation=evaluation, session__completed_at__isnull=False) \
+        .order_by('question__order', 'session_id') \
+        .values_list('question__order', 'session_id', *fields) \
+        .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+    if Session.objects.filter(evaluation=evaluation, packed_answers__isnull=False).exists():
+        rows = heapq.merge(rows, iter_packed_answers(evaluation, fields), key=itemgetter(0, 1))
+    for order, _, *values in rows:
+        yield (order, *values)
+
+
+def iter_packed_answers(evaluation: Evaluation, fields):
+    """
+    Yields ``(order, session id, *fields)`` of answers in packed sessions,
+    ordered like ``iter_completed_answers``. Sessions are read in chunks, but going
+    by question needs unpacked answers of all of them, two bytes per question each.
+    """
+    packed = list(Session.packed(evaluation, *[
+        field[len('session__'):] for field in fields if field != 'answer'
+    ]))
+    orders = Question.objects \
+        .filter(evaluation=evaluation) \
+        .order_by('order') \
+        .values_list('order', flat=True)
+    for order in orders.iterator():
+        for id, answers, *values in packed:
+            if order >= len(answers) or answers[order] == NO_ANSWER:
+                continue
+            session_values = iter(values)
+            yield (order, id, *[
+                answers[order] if field == 'answer' else next(session_values) for field in fields
+            ])
+
+
+def iter_results_json(evaluation: Evaluation):
+    """
+    Yields ``{"<question order>": [answers, ...], ...}`` document piece by piece
+    """
+    orders = Question.objects \
+        .filter(evaluation=evaluation) \
+        .order_by('order') \
+        .values_list('order', flat=True)
+    answers = groupby(iter_completed_answers(evaluation, 'answer'), key=itemgetter(0))
+    order_answers = next(answers, None)
+
+    yield '{'
+    for no, order in enumerate(orders.iterator()):
+        values = []
+        # Both streams are sorted by order, so merge them
+        while order_answers is not None and order_answers[0] <= order:
+            if order_answers[0] == order:
+                values = [answer for _, answer in order_answers[1]]
+            order_answers = next(answers, None)
+        yield f'{", " if no else ""}"{order}": {json.dumps(values)}'
+    yield '}'
+
+
+class Echo:
+    """
+    File-like object returning written value instead of buffering it, for csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_results_csv(evaluation: Evaluation):
+    writer = csv.writer(Echo())
+    yield writer.writerow(['session', 'user_name', 'question', 'answer',
+                           'session_created_at', 'session_completed_at'])
+    for order, hash, user_name, answer, created_at, completed_at in iter_completed_answers(
+            evaluation, 'session__hash', 'session__user_name', 'answer',
+            'session__created_at', 'session__completed_at'):
+        yield writer.writerow([hash, user_name, order, answer,
+                               created_at.isoformat(), completed_at.isoformat()])
+
+
+def results_etag(request: HttpRequest, id: int, **kwargs):
+    return EvaluationCounter.etag(id)
+
+
+@login_required()
+@condition(etag_func=results_etag)
+def export_results(request: HttpRequest, id: int, format: str = 'json'):
+    evaluation = Evaluation.objects.get(id=id)
+
+    if format == 'csv':
+        response = StreamingHttpResponse(iter_results_csv(evaluation), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="results-{evaluation.id}.csv"'
+    else:
+        response = StreamingHttpResponse(iter_results_json(evaluation),
+                                         content_type='application/json')
+    return response
+
+
+@login_required()
+@condition(etag_func=results_etag)
+def export_summary(request: HttpRequest, id: int):
+    evaluation = Evaluation.objects.get(id=id)
+    return JsonResponse(EvaluationCounter.summary(evaluation))
+
+
 @login_required()
-def export_results(request: HttpRequest, id: int):
+@condition(etag_func=results_etag)
+def export_rankings(request: HttpRequest, id: int):
+    """
+    Methods of pairwise evaluation from the best, with 95% intervals of their ratings
+    """
     evaluation = Evaluation.objects.get(id=id)
-    questions = Question.objects.filter(evaluation=evaluation)
-
-    result = {}
-    for q in questions:
-        answers = [a.answer for a in
-                   Assignment.objects.filter(question=q, session__completed_at__isnull=False)]
-        result[q.order] = answers
-    response = HttpResponse(content_type="application/json")
-    json.dump(result, response)
+    return JsonResponse(dict(rankings=Method.rankings(evaluation)))
+
+
+@login_required()
+@condition(etag_func=results_etag)
+def export_analysis(request: HttpRequest, id: int):
+    """
+    Answer matrix of completed sessions with its statistics as NumPy ``.npz``,
+    see ``analysis.analyze``
+    """
+    evaluation = Evaluation.objects.get(id=id)
+    response = HttpResponse(analysis.export_npz(evaluation),
+                            content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="analysis-{evaluation.id}.npz"'
     return response
 
 
-__all__ = ['session_view', 'new_session', 'export_results']
+def parse_feed_cursor(cursor: str):
+    """
+    :return: (last answer id, last completion number) from ``"<answer id>-<completion number>"``
+    """
+    answer_id, completion_seq = cursor.split('-')
+    return int(answer_id), int(completion_seq)
+
+
+@login_required()
+def export_feed(request: HttpRequest, id: int):
+    """
+    Answers, including ones of sessions in progress, and session completions recorded after
+    ``cursor`` returned by the previous request, at most ``FEED_PAGE_SIZE`` of each.
+    Answer ids and completion numbers only grow in commit order as SQLite has a single
+    writer, so nothing committed later can appear behind the cursor.
+    That doesn't hold for answers moved by ``pack_answers``: packed ones are never
+    listed, and unpacked ones get new ids, so they are listed again after the cursor.
+    """
+    evaluation = Evaluation.objects.get(id=id)
+    try:
+        last_answer, last_completion = parse_feed_cursor(request.GET.get('cursor', '0-0'))
+    except ValueError:
+        return JsonResponse({'error': 'cursor must be "<answer id>-<completion number>"'},
+                            status=400)
+
+    # Both walk an index from the cursor, so only rows since it are read
+    answers = list(Assignment.objects
+                   .filter(evaluation=evaluation, id__gt=last_answer)
+                   .order_by('id')
+                   .values_list('id', 'session__hash', 'question__order', 'answer')
+                   [:settings.FEED_PAGE_SIZE])
+    completions = list(Session.objects
+                       .filter(evaluation=evaluation, completion_seq__gt=last_completion)
+                       .order_by('completion_seq')
+                       .values_list('completion_seq', 'hash', 'user_name', 'completed_at')
+                       [:settings.FEED_PAGE_SIZE])
+
+    if answers:
+        last_answer = answers[-1][0]
+    if completions:
+        last_completion = completions[-1][0]
+    return JsonResponse(dict(
+        answers=[dict(session=hash, question=order, answer=answer)
+                 for _, hash, order, answer in answers],
+        completions=[dict(session=hash, user_name=user_name, completed_at=completed_at)
+                     for _, hash, user_name, completed_at in completions],
+        cursor=f'{last_answer}-{last_completion}',
+        more=settings.FEED_PAGE_SIZE in (len(answers), len(completions))
+    ))
+
+
+__all__ = ['session_view', 'new_session', 'export_results', 'export_summary', 'export_rankings',
+           'export_feed', 'export_analysis']
@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple, TypeVar
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CoalescingWriter:
+    """
+    Runs database writes submitted by request threads of a worker process in a single
+    background thread, grouping writes arriving within ``window`` seconds into one
+    transaction. Each write runs in its own savepoint, so a failing one doesn't affect
+    others, while the commit and the database lock are shared by the whole batch.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, work: Callable[[], T]) -> T:
+        """
+        Runs ``work`` in a batch transaction and waits for the batch commit
+        """
+        future = Future()
+        self.queue.put((work, future))
+        self.start()
+        return future.result()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='answer-writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch: List[Tuple[Callable, Future]]):
+        results = []
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                for work, future in batch:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, work(), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.exception('Batch of %s writes failed', len(batch))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_answer_writer() -> CoalescingWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CoalescingWriter(settings.ANSWER_COALESCE_WINDOW,
+                                       settings.ANSWER_COALESCE_MAX_BATCH)
+        return _writer
+
+
+def write_answers(work: Callable[[], T]) -> T:
+    """
+    Runs ``work`` recording answers in a transaction, shared with concurrent requests
+    of this worker process when ``ANSWER_COALESCE_WINDOW`` is set
+    """
+    if settings.ANSWER_COALESCE_WINDOW:
+        return get_answer_writer().submit(work)
+    with transaction.atomic():
+        return work()